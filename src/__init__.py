@@ -1,5 +1,5 @@
 from .connection import ConnectionHandler, ConnectPacket
-from .session import SessionState, QoSMessage
+from .session import SessionState, QoSMessage, QoSState, SubscriptionTable
 from .will_message import WillMessage, QoSLevel
 from .publish import PublishHandler, PublishPacket
 from .message_handler import MessageHandler, MessageQueue, RetainedMessage
@@ -9,6 +9,8 @@ __all__ = [
     'ConnectPacket',
     'SessionState',
     'QoSMessage',
+    'QoSState',
+    'SubscriptionTable',
     'WillMessage',
     'QoSLevel',
     'PublishHandler',
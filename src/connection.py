@@ -145,18 +145,20 @@ class ConnectionHandler:
 
     def _decode_connect_packet(self, data: bytes) -> ConnectPacket:
         """Decode CONNECT packet from bytes"""
+        # Slice through a memoryview so fields are not copied until decoded
+        view = memoryview(data)
         pos = 0
         
         # Protocol name and level
-        protocol_name_len = int.from_bytes(data[pos:pos+2], 'big')
+        protocol_name_len = int.from_bytes(view[pos:pos+2], 'big')
         pos += 2
-        protocol_name = data[pos:pos+protocol_name_len].decode()
+        protocol_name = str(view[pos:pos+protocol_name_len], 'utf-8')
         pos += protocol_name_len
-        protocol_level = data[pos]
+        protocol_level = view[pos]
         pos += 1
         
         # Connect flags
-        flags = data[pos]
+        flags = view[pos]
         pos += 1
         clean_session = bool(flags & 0x02)
         will_flag = bool(flags & 0x04)
@@ -166,26 +168,26 @@ class ConnectionHandler:
         password_flag = bool(flags & 0x40)
         
         # Keep alive
-        keep_alive = int.from_bytes(data[pos:pos+2], 'big')
+        keep_alive = int.from_bytes(view[pos:pos+2], 'big')
         pos += 2
         
         # Client ID
-        client_id_len = int.from_bytes(data[pos:pos+2], 'big')
+        client_id_len = int.from_bytes(view[pos:pos+2], 'big')
         pos += 2
-        client_id = data[pos:pos+client_id_len].decode()
+        client_id = str(view[pos:pos+client_id_len], 'utf-8')
         pos += client_id_len
         
         # Will message
         will_message = None
         if will_flag:
-            will_topic_len = int.from_bytes(data[pos:pos+2], 'big')
+            will_topic_len = int.from_bytes(view[pos:pos+2], 'big')
             pos += 2
-            will_topic = data[pos:pos+will_topic_len].decode()
+            will_topic = str(view[pos:pos+will_topic_len], 'utf-8')
             pos += will_topic_len
             
-            will_payload_len = int.from_bytes(data[pos:pos+2], 'big')
+            will_payload_len = int.from_bytes(view[pos:pos+2], 'big')
             pos += 2
-            will_payload = data[pos:pos+will_payload_len]
+            will_payload = bytes(view[pos:pos+will_payload_len])
             pos += will_payload_len
             
             from .will_message import WillMessage, QoSLevel
@@ -199,17 +201,17 @@ class ConnectionHandler:
         # Username
         username = None
         if username_flag:
-            username_len = int.from_bytes(data[pos:pos+2], 'big')
+            username_len = int.from_bytes(view[pos:pos+2], 'big')
             pos += 2
-            username = data[pos:pos+username_len].decode()
+            username = str(view[pos:pos+username_len], 'utf-8')
             pos += username_len
         
         # Password
         password = None
         if password_flag:
-            password_len = int.from_bytes(data[pos:pos+2], 'big')
+            password_len = int.from_bytes(view[pos:pos+2], 'big')
             pos += 2
-            password = data[pos:pos+password_len]
+            password = bytes(view[pos:pos+password_len])
             pos += password_len
         
         return ConnectPacket(
@@ -1,12 +1,14 @@
+from array import array
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Dict, Optional, Protocol, Set
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Optional, Protocol, Set, Tuple
 import asyncio
 from enum import IntEnum
 
 from .will_message import QoSLevel
 from .publish import PublishPacket, PublishHandler
-from .session import QoSMessage, SessionState
+from .session import QoSMessage, QoSState, SessionState
 from .subscribe import SubscriptionHandler
 
 @dataclass
@@ -24,11 +26,45 @@ class RetainedMessage:
     timestamp: datetime
     last_modified: datetime
 
+# Batches larger than this rebuild the retained arrays in a single pass
+RETAINED_BATCH_REBUILD_THRESHOLD = 16
+
+class _RetainedView(Mapping):
+    """Live read-only topic -> RetainedMessage view over a queue's retained arrays"""
+    __slots__ = ('_queue',)
+
+    def __init__(self, queue: 'MessageQueue'):
+        self._queue = queue
+
+    def __getitem__(self, topic: str) -> RetainedMessage:
+        queue = self._queue
+        return queue._retained_message(queue._retained_index[topic])
+
+    def __contains__(self, topic: object) -> bool:
+        return topic in self._queue._retained_index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._queue._retained_topics)
+
+    def __len__(self) -> int:
+        return len(self._queue._retained_topics)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({dict(self.items())!r})"
+
 class MessageQueue:
     """Message queue implementation for handling messages"""
     def __init__(self):
         self.queue: asyncio.Queue = asyncio.Queue()
-        self.retained_messages: Dict[str, RetainedMessage] = {}
+        # Retained store kept as parallel arrays so delivery scans stay linear;
+        # RetainedMessage objects are only built for single-topic lookups
+        self._retained_topics: List[str] = []
+        self._retained_payloads: List[bytes] = []
+        self._retained_qos: array = array('B')
+        self._retained_timestamps: List[datetime] = []
+        self._retained_modified: List[datetime] = []
+        self._retained_index: Dict[str, int] = {}
+        self._retained_view = _RetainedView(self)
         self.inflight_messages: Dict[str, Dict[int, QoSMessage]] = {}
         
     async def put(self, message: Message) -> None:
@@ -38,14 +74,104 @@ class MessageQueue:
     async def get(self) -> Message:
         """Get next message from queue"""
         return await self.queue.get()
+
+    @property
+    def retained_messages(self) -> Mapping:
+        """Live read-only view of retained messages keyed by topic
+        
+        Writes raise TypeError/AttributeError; use store_retained_message,
+        clear_retained or clear_retained_batch instead.
+        """
+        return self._retained_view
     
     def store_retained_message(self, topic: str, message: RetainedMessage) -> None:
-        """Store retained message"""
-        self.retained_messages[topic] = message
+        """Store retained message, an empty payload clears the topic"""
+        if not message.payload:
+            self._remove_retained(topic)
+            return
+        index = self._retained_index.setdefault(topic, len(self._retained_topics))
+        if index == len(self._retained_topics):
+            self._retained_topics.append(topic)
+            self._retained_payloads.append(message.payload)
+            self._retained_qos.append(message.qos)
+            self._retained_timestamps.append(message.timestamp)
+            self._retained_modified.append(message.last_modified)
+        else:
+            self._retained_payloads[index] = message.payload
+            self._retained_qos[index] = message.qos
+            self._retained_timestamps[index] = message.timestamp
+            self._retained_modified[index] = message.last_modified
         
     def get_retained_message(self, topic: str) -> Optional[RetainedMessage]:
         """Get retained message for topic"""
-        return self.retained_messages.get(topic)
+        index = self._retained_index.get(topic)
+        if index is None:
+            return None
+        return self._retained_message(index)
+
+    def _retained_message(self, index: int) -> RetainedMessage:
+        """Assemble the retained message stored at an array slot"""
+        return RetainedMessage(
+            topic=self._retained_topics[index],
+            payload=self._retained_payloads[index],
+            qos=QoSLevel(self._retained_qos[index]),
+            timestamp=self._retained_timestamps[index],
+            last_modified=self._retained_modified[index]
+        )
+
+    def iter_retained(self) -> Iterator[Tuple[str, bytes, int]]:
+        """Iterate (topic, payload, qos) over all retained messages"""
+        return zip(self._retained_topics, self._retained_payloads, self._retained_qos)
+
+    def clear_retained(self) -> None:
+        """Drop every retained message"""
+        self._retained_topics.clear()
+        self._retained_payloads.clear()
+        del self._retained_qos[:]
+        self._retained_timestamps.clear()
+        self._retained_modified.clear()
+        self._retained_index.clear()
+
+    def clear_retained_batch(self, topics: Iterable[str]) -> None:
+        """Clear retained messages for many topics at once"""
+        drops = {topic for topic in topics if topic in self._retained_index}
+        if len(drops) <= RETAINED_BATCH_REBUILD_THRESHOLD:
+            for topic in drops:
+                self._remove_retained(topic)
+            return
+
+        keep = [
+            index for index, topic in enumerate(self._retained_topics)
+            if topic not in drops
+        ]
+        self._retained_topics = [self._retained_topics[i] for i in keep]
+        self._retained_payloads = [self._retained_payloads[i] for i in keep]
+        self._retained_qos = array('B', (self._retained_qos[i] for i in keep))
+        self._retained_timestamps = [self._retained_timestamps[i] for i in keep]
+        self._retained_modified = [self._retained_modified[i] for i in keep]
+        self._retained_index = {
+            topic: index for index, topic in enumerate(self._retained_topics)
+        }
+
+    def _remove_retained(self, topic: str) -> None:
+        """Drop a retained topic by moving the last entry into its slot"""
+        index = self._retained_index.pop(topic, None)
+        if index is None:
+            return
+        last = len(self._retained_topics) - 1
+        if index != last:
+            moved = self._retained_topics[last]
+            self._retained_topics[index] = moved
+            self._retained_payloads[index] = self._retained_payloads[last]
+            self._retained_qos[index] = self._retained_qos[last]
+            self._retained_timestamps[index] = self._retained_timestamps[last]
+            self._retained_modified[index] = self._retained_modified[last]
+            self._retained_index[moved] = index
+        self._retained_topics.pop()
+        self._retained_payloads.pop()
+        self._retained_qos.pop()
+        self._retained_timestamps.pop()
+        self._retained_modified.pop()
     
     def track_inflight_message(self, client_id: str, message: QoSMessage) -> None:
         """Track inflight QoS message"""
@@ -59,18 +185,39 @@ class MessageHandler:
         self.message_queue = MessageQueue()
         self.publish_handler = PublishHandler()
         self.subscription_handler = SubscriptionHandler()
+        # Acknowledgments get their own channel so they never wait behind publishes
+        self.ack_queue: asyncio.Queue = asyncio.Queue()
+        # Background tasks owned by this handler, cancelled by stop()
+        self._tasks: Set[asyncio.Task] = set()
         self.sessions: Dict[str, SessionState] = {}
         self.retry_interval: float = 5.0
         self.max_retries: int = 3
         
     async def start(self) -> None:
         """Start message handling loop"""
-        asyncio.create_task(self._process_message_queue())
+        self._spawn(self._process_message_queue())
+        self._spawn(self._process_ack_queue())
+
+    async def stop(self) -> None:
+        """Cancel background tasks started by this handler"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _spawn(self, coro) -> asyncio.Task:
+        """Create a task tracked until it completes"""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
         
     async def _process_message_queue(self) -> None:
         """Main message processing loop"""
         while True:
             message = await self.message_queue.get()
+            # Acknowledgments that arrived meanwhile take priority
+            self._drain_acknowledgments()
             try:
                 if isinstance(message, PublishPacket):
                     await self._handle_publish(message)
@@ -114,9 +261,7 @@ class MessageHandler:
                 self.message_queue.track_inflight_message(client_id, qos_msg)
                 
                 # Start QoS retry handler
-                asyncio.create_task(
-                    self._handle_qos_retry(client_id, qos_msg, packet)
-                )
+                self._spawn(self._handle_qos_retry(client_id, qos_msg, packet))
                 
             # Add to client's session for delivery
             if client_id in self.sessions:
@@ -124,10 +269,11 @@ class MessageHandler:
                 if effective_qos > QoSLevel.AT_MOST_ONCE:
                     session.pending_messages[qos_msg.message_id] = qos_msg
                 
-    async def _handle_qos_retry(self, client_id: str, qos_msg: QoSMessage, packet: PublishPacket) -> None:
+    async def _handle_qos_retry(self, client_id: str, qos_msg: QoSMessage, packet: PublishPacket,
+                                sleep=asyncio.sleep) -> None:
         """Handle QoS message retry logic"""
         while qos_msg.retry_count < self.max_retries and not qos_msg.ack_received:
-            await asyncio.sleep(self.retry_interval * (qos_msg.retry_count + 1))
+            await sleep(self.retry_interval * (qos_msg.retry_count + 1))
             
             if qos_msg.ack_received:
                 break
@@ -139,13 +285,39 @@ class MessageHandler:
                 # Note: Actual transmission would be handled by connection manager
                 packet.dup = True
                 
-        if not qos_msg.ack_received and client_id in self.sessions:
-            # Clean up failed delivery
-            session = self.sessions[client_id]
-            session.pending_messages.pop(qos_msg.message_id, None)
+        if not qos_msg.ack_received:
+            # Clean up failed delivery; the packet ID goes back to the allocator
+            # even if the client disconnected while retries were pending
+            qos_msg.timeout_occurred = True
+            session = self.sessions.get(client_id)
+            if session is not None:
+                session.pending_messages.pop(qos_msg.message_id, None)
+            self.publish_handler._free_packet_id(qos_msg.message_id)
             
+    async def _process_ack_queue(self) -> None:
+        """Acknowledgment processing loop"""
+        while True:
+            client_id, packet_id, ack_type = await self.ack_queue.get()
+            self._apply_acknowledgment(client_id, packet_id, ack_type)
+
+    def _drain_acknowledgments(self) -> None:
+        """Apply every acknowledgment currently waiting in the ack queue"""
+        while not self.ack_queue.empty():
+            self._apply_acknowledgment(*self.ack_queue.get_nowait())
+
+    def enqueue_acknowledgment(self, client_id: str, packet_id: int, ack_type: str) -> None:
+        """Queue an acknowledgment without waiting for it to be applied"""
+        self.ack_queue.put_nowait((client_id, packet_id, ack_type))
+
     async def handle_message_acknowledgment(self, client_id: str, packet_id: int, ack_type: str) -> None:
         """Handle message acknowledgments (PUBACK, PUBREC, PUBREL, PUBCOMP)"""
+        # Through the ack queue, so acknowledgments queued earlier are applied first;
+        # draining here means the caller sees this one applied on return
+        self.enqueue_acknowledgment(client_id, packet_id, ack_type)
+        self._drain_acknowledgments()
+
+    def _apply_acknowledgment(self, client_id: str, packet_id: int, ack_type: str) -> None:
+        """Update QoS state of a pending message for an acknowledgment"""
         if client_id in self.sessions:
             session = self.sessions[client_id]
             if packet_id in session.pending_messages:
@@ -153,12 +325,13 @@ class MessageHandler:
                 
                 if ack_type == "PUBACK" or ack_type == "PUBCOMP":
                     qos_msg.ack_received = True
-                    qos_msg.state = "COMPLETED"
+                    qos_msg.state = QoSState.COMPLETED
                     session.pending_messages.pop(packet_id, None)
+                    self.publish_handler._free_packet_id(packet_id)
                 elif ack_type == "PUBREC":
-                    qos_msg.state = "PUBREC_RECEIVED"
+                    qos_msg.state = QoSState.PUBREC_RECEIVED
                 elif ack_type == "PUBREL":
-                    qos_msg.state = "PUBREL_RECEIVED"
+                    qos_msg.state = QoSState.PUBREL_RECEIVED
                     
     def get_session_messages(self, client_id: str) -> Dict[int, QoSMessage]:
         """Get pending messages for a client session"""
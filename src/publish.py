@@ -1,11 +1,13 @@
+from collections import OrderedDict
 from dataclasses import dataclass
 from datetime import datetime
 from enum import IntEnum
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterable, List, Set, Tuple
 import asyncio
+import sys
 
 from .will_message import QoSLevel
-from .session import QoSMessage
+from .session import QoSMessage, QoSState
 
 class MessageType(IntEnum):
     PUBLISH = 3
@@ -14,7 +16,49 @@ class MessageType(IntEnum):
     PUBREL = 6
     PUBCOMP = 7
 
-@dataclass
+# First fixed-header byte of a PUBLISH, indexed by (qos << 2) | (dup << 1) | retain
+_HEADER0 = tuple(
+    bytes(((MessageType.PUBLISH << 4) | (qos << 1) | (dup << 3) | retain,))
+    for qos in range(4) for dup in (0, 1) for retain in (0, 1)
+)
+
+# Single-byte remaining lengths
+_VARINT = tuple(bytes((n,)) for n in range(128))
+
+MAX_REMAINING_LENGTH = 268_435_455  # Largest value a 4-byte varint can hold
+
+def _encode_remaining_length(length: int) -> bytes:
+    """Encode a remaining length as an MQTT variable byte integer"""
+    if not 0 <= length <= MAX_REMAINING_LENGTH:
+        raise ValueError(f"Remaining length {length} out of range")
+    encoded = bytearray()
+    while True:
+        byte = length & 0x7F
+        length >>= 7
+        if length:
+            encoded.append(byte | 0x80)
+        else:
+            encoded.append(byte)
+            return bytes(encoded)
+
+TOPIC_CACHE_SIZE = 4096
+_topic_cache: 'OrderedDict[str, bytes]' = OrderedDict()
+
+def _encode_topic(topic: str) -> bytes:
+    """Return the length-prefixed UTF-8 topic field, cached per topic (LRU)"""
+    encoded = _topic_cache.get(topic)
+    if encoded is None:
+        topic_bytes = topic.encode('utf-8')
+        encoded = len(topic_bytes).to_bytes(2, 'big') + topic_bytes
+        _topic_cache[topic] = encoded
+        if len(_topic_cache) > TOPIC_CACHE_SIZE:
+            _topic_cache.popitem(last=False)
+    else:
+        # Hot topics stay at the recent end and survive eviction
+        _topic_cache.move_to_end(topic)
+    return encoded
+
+@dataclass(slots=True)
 class PublishPacket:
     topic: str
     payload: bytes
@@ -25,55 +69,81 @@ class PublishPacket:
 
     def encode(self) -> bytes:
         """Encode the PUBLISH packet into bytes"""
-        # Variable header
-        packet = bytearray()
-        
-        # Topic name
-        packet.extend(len(self.topic).to_bytes(2, 'big'))
-        packet.extend(self.topic.encode())
-        
-        # Packet identifier (only for QoS > 0)
+        return b"".join(self.encode_chunks())
+
+    def encode_chunks(self) -> List[bytes]:
+        """Return the packet as buffers for vectored writes, sharing the payload"""
+        # Variable header: topic name, then packet identifier (only for QoS > 0)
+        variable_header = [_encode_topic(self.topic)]
         if self.qos != QoSLevel.AT_MOST_ONCE:
             if self.packet_id is None:
                 raise ValueError("Packet ID required for QoS > 0")
-            packet.extend(self.packet_id.to_bytes(2, 'big'))
-        
-        # Payload
-        packet.extend(self.payload)
+            variable_header.append(self.packet_id.to_bytes(2, 'big'))
         
         # Fixed header
-        fixed_header = bytearray()
-        header_byte = MessageType.PUBLISH << 4
-        if self.dup:
-            header_byte |= 0x08
-        header_byte |= (self.qos << 1)
-        if self.retain:
-            header_byte |= 0x01
-        fixed_header.append(header_byte)
-        
-        # Add remaining length
-        remaining_length = len(packet)
-        while remaining_length > 0:
-            byte = remaining_length & 0x7F
-            remaining_length >>= 7
-            if remaining_length > 0:
-                byte |= 0x80
-            fixed_header.append(byte)
-        
-        return bytes(fixed_header + packet)
+        remaining_length = sum(map(len, variable_header)) + len(self.payload)
+        return [
+            _HEADER0[(self.qos << 2) | (self.dup << 1) | self.retain],
+            _VARINT[remaining_length] if remaining_length < 128
+            else _encode_remaining_length(remaining_length),
+            *variable_header,
+            self.payload
+        ]
+
+# Packet ID allocator: 65536 IDs tracked as bits, scanned 64 at a time
+PACKET_ID_BITMAP_SIZE = 65536 // 8
+_FULL_WORD = (1 << 64) - 1
+
+# Retry timer wheel geometry: a retransmit is due TICKS_PER_INTERVAL ticks
+# after it is scheduled, so WHEEL_SIZE only has to exceed that offset
+WHEEL_SIZE = 64
+TICKS_PER_INTERVAL = 4
 
 class PublishHandler:
-    def __init__(self):
-        self.next_packet_id: int = 1
+    def __init__(self, wait_for=asyncio.wait_for):
         self.pending_qos_messages: Dict[int, QoSMessage] = {}
         self.retry_interval: float = 5.0  # seconds
         self.max_retries: int = 3
+        self.retransmit_callback = None  # Callback for retransmission
+        self._transport = None  # Writer for fire-and-forget QoS 0 publishes
+
+        # Single driver task advancing a hashed wheel of packet IDs due for retry
+        self._wheel: List[Set[int]] = [set() for _ in range(WHEEL_SIZE)]
+        self._tick_index: int = 0
+        # Wheel slot + 1 each packet ID is scheduled in, 0 when not scheduled
+        self._retry_slot = bytearray(65536)
+        self._retry_task: Optional[asyncio.Task] = None
+        self._wait_for = wait_for  # Timeout primitive driving the wheel; swappable for a virtual clock
+        self._drained = asyncio.Event()  # Set once nothing is left in flight
+        self._inflight_packets: Dict[int, PublishPacket] = {}
+
+        # One bit per packet ID in use; ID 0 is reserved by the protocol
+        self._id_bitmap = bytearray(PACKET_ID_BITMAP_SIZE)
+        self._id_bitmap[0] = 0x01
+        self._next_id_hint: int = 1
 
     def _get_next_packet_id(self) -> int:
-        """Generate next packet ID for QoS > 0 messages"""
-        packet_id = self.next_packet_id
-        self.next_packet_id = (self.next_packet_id + 1) % 65536  # Keep within 16 bits
-        return packet_id
+        """Allocate the next free packet ID for QoS > 0 messages"""
+        bitmap = self._id_bitmap
+        words = len(bitmap) >> 3
+        start = self._next_id_hint >> 6
+        for i in range(words):
+            word_index = (start + i) % words
+            offset = word_index << 3
+            word = int.from_bytes(bitmap[offset:offset + 8], 'little')
+            if word != _FULL_WORD:
+                # Isolate the lowest clear bit of the 64-bit word
+                bit = (~word & (word + 1)).bit_length() - 1
+                packet_id = (word_index << 6) | bit
+                bitmap[packet_id >> 3] |= 1 << (packet_id & 7)
+                self._next_id_hint = (packet_id + 1) & 0xFFFF
+                return packet_id
+        raise RuntimeError("No free packet IDs available")
+
+    def _free_packet_id(self, packet_id: int) -> None:
+        """Return a packet ID to the allocator"""
+        if packet_id:
+            self._id_bitmap[packet_id >> 3] &= ~(1 << (packet_id & 7))
 
     async def publish_message(self, topic: str, payload: bytes, qos: QoSLevel = QoSLevel.AT_MOST_ONCE, 
                             retain: bool = False) -> Optional[int]:
@@ -90,9 +160,9 @@ class PublishHandler:
             )
             self.pending_qos_messages[packet_id] = qos_message
         
-        # Create and encode publish packet
+        # Create and encode publish packet; repeated topics share one string
         packet = PublishPacket(
-            topic=topic,
+            topic=sys.intern(topic),
             payload=payload,
             qos=qos,
             retain=retain,
@@ -101,79 +171,201 @@ class PublishHandler:
         
         # Start QoS handling process if needed
         if qos != QoSLevel.AT_MOST_ONCE:
-            asyncio.create_task(self._handle_qos_retry(packet))
+            self._schedule_retry(packet)
         
         return packet_id
 
-    def __init__(self):
-        self.next_packet_id: int = 1
-        self.pending_qos_messages: Dict[int, QoSMessage] = {}
-        self.retry_interval: float = 5.0  # seconds
-        self.max_retries: int = 3
-        self.retransmit_callback = None  # Callback for retransmission
+    def set_transport(self, transport) -> None:
+        """Set the writer used by publish_qos0"""
+        self._transport = transport
+
+    def publish_qos0(self, topic: str, payload: bytes, retain: bool = False) -> None:
+        """Write a QoS 0 message straight to the transport without scheduling"""
+        if self._transport is None:
+            raise RuntimeError("No transport set for QoS 0 publish")
+        packet = PublishPacket(topic, payload, QoSLevel.AT_MOST_ONCE, retain=retain)
+        self._transport.writelines(packet.encode_chunks())
+
+    def publish_messages(self, batch: Iterable[Tuple[str, bytes, QoSLevel]],
+                         retain: bool = False) -> List[Optional[int]]:
+        """Publish a batch of (topic, payload, qos) messages, returning their packet IDs"""
+        batch = list(batch)
+        
+        # Reserve every packet ID up front; QoS 0 messages get None
+        packet_ids: List[Optional[int]] = []
+        try:
+            for _, _, qos in batch:
+                packet_ids.append(
+                    None if qos == QoSLevel.AT_MOST_ONCE else self._get_next_packet_id()
+                )
+        except Exception:
+            # Give back the IDs taken before the failure
+            for packet_id in packet_ids:
+                if packet_id is not None:
+                    self._free_packet_id(packet_id)
+            raise
+
+        # Register tracking state in one update
+        timestamp = datetime.now()
+        tracked = [
+            (packet_id, topic, payload, qos)
+            for packet_id, (topic, payload, qos) in zip(packet_ids, batch)
+            if packet_id is not None
+        ]
+        self.pending_qos_messages.update(
+            (packet_id, QoSMessage(message_id=packet_id, qos_level=qos, timestamp=timestamp))
+            for packet_id, _, _, qos in tracked
+        )
+
+        for packet_id, topic, payload, qos in tracked:
+            packet = PublishPacket(
+                topic=sys.intern(topic),
+                payload=payload,
+                qos=qos,
+                retain=retain,
+                packet_id=packet_id
+            )
+            self._schedule_retry(packet)
+
+        return packet_ids
+
+    def reset(self) -> None:
+        """Drop all in-flight state so the handler can be reused"""
+        if self._retry_task is not None:
+            self._retry_task.cancel()
+            self._retry_task = None
+        self._inflight_packets.clear()
+        self.pending_qos_messages.clear()
+        for slot in self._wheel:
+            slot.clear()
+        self._tick_index = 0
+        self._retry_slot[:] = bytes(len(self._retry_slot))
+        self._id_bitmap[:] = bytes(len(self._id_bitmap))
+        self._id_bitmap[0] = 0x01
+        self._next_id_hint = 1
 
     def set_retransmit_callback(self, callback):
         """Set callback function for packet retransmission"""
         self.retransmit_callback = callback
 
-    async def _handle_qos_retry(self, packet: PublishPacket) -> None:
-        """Handle QoS retry logic for QoS 1 and 2"""
-        if packet.packet_id is None or packet.packet_id not in self.pending_qos_messages:
+    def _schedule_retry(self, packet: PublishPacket) -> None:
+        """Put a packet on the retry wheel one retry interval from now"""
+        self._inflight_packets[packet.packet_id] = packet
+        self._wheel_add(packet.packet_id)
+        self._drained.clear()
+        if self._retry_task is None or self._retry_task.done():
+            self._retry_task = asyncio.create_task(self._tick())
+
+    def _wheel_add(self, packet_id: int) -> None:
+        """Schedule a packet ID one retry interval past the current tick"""
+        slot = (self._tick_index + TICKS_PER_INTERVAL) % WHEEL_SIZE
+        self._wheel[slot].add(packet_id)
+        self._retry_slot[packet_id] = slot + 1
+
+    def _wheel_remove(self, packet_id: int) -> None:
+        """Unschedule a packet ID so a later reuse of it keeps its own deadline"""
+        slot = self._retry_slot[packet_id]
+        if slot:
+            self._wheel[slot - 1].discard(packet_id)
+            self._retry_slot[packet_id] = 0
+
+    def _discard_inflight(self, packet_id: int) -> None:
+        """Stop tracking an in-flight packet"""
+        self._wheel_remove(packet_id)
+        self._inflight_packets.pop(packet_id, None)
+        if not self._inflight_packets:
+            self._drained.set()
+
+    async def _tick(self) -> None:
+        """Drive the retry wheel while any packet is in flight"""
+        while self._inflight_packets:
+            # Wake early when the last in-flight packet is acknowledged
+            try:
+                await self._wait_for(
+                    self._drained.wait(), self.retry_interval / TICKS_PER_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                await self._advance()
+
+    async def _advance(self) -> None:
+        """Move the wheel one tick and retry every packet in the new slot"""
+        self._tick_index = slot = (self._tick_index + 1) % WHEEL_SIZE
+        due = self._wheel[slot]
+        self._wheel[slot] = set()
+        for packet_id in due:
+            # Skip IDs released and rescheduled by an earlier retry's callback
+            if self._retry_slot[packet_id] != slot + 1:
+                continue
+            self._retry_slot[packet_id] = 0
+            await self._retry(packet_id)
+
+    async def _retry(self, packet_id: int) -> None:
+        """Retransmit a packet, expiring it once max retries is reached"""
+        packet = self._inflight_packets.get(packet_id)
+        qos_message = self.pending_qos_messages.get(packet_id)
+        if packet is None or qos_message is None or qos_message.ack_received:
+            self._discard_inflight(packet_id)
             return
+
+        # Increment retry count and update message
+        qos_message.retry_count += 1
+        packet.dup = True  # Set DUP flag for retransmission
         
-        qos_message = self.pending_qos_messages[packet.packet_id]
-        retry_count = 0
+        # Perform actual retransmission if callback is set
+        if self.retransmit_callback:
+            try:
+                await self.retransmit_callback(packet)
+                qos_message.last_sent = datetime.now()
+                qos_message.state = QoSState.RETRANSMITTED
+            except Exception as e:
+                print(f"Retransmission failed: {e}")
+                qos_message.state = QoSState.RETRANSMISSION_FAILED
+        else:
+            print("Warning: No retransmit callback set. Packet cannot be retransmitted.")
+
+        # An ACK during the callback already released the packet; its ID may
+        # even be carrying a new message by now, which must be left alone
+        if self._inflight_packets.get(packet_id) is not packet:
+            return
         
-        while retry_count < self.max_retries and not qos_message.ack_received:
-            # Initial delay before first retry
-            await asyncio.sleep(self.retry_interval)
-            
-            # Check if message was acknowledged during sleep
-            if qos_message.ack_received or packet.packet_id not in self.pending_qos_messages:
-                break
-            
-            # Increment retry count and update message
-            retry_count += 1
-            qos_message.retry_count = retry_count
-            packet.dup = True  # Set DUP flag for retransmission
-            
-            # Perform actual retransmission if callback is set
-            if self.retransmit_callback:
-                try:
-                    await self.retransmit_callback(packet)
-                    qos_message.last_sent = datetime.now()
-                    qos_message.state = "RETRANSMITTED"
-                except Exception as e:
-                    print(f"Retransmission failed: {e}")
-                    qos_message.state = "RETRANSMISSION_FAILED"
-            else:
-                print("Warning: No retransmit callback set. Packet cannot be retransmitted.")
-            
         # Remove message after max retries if not acknowledged
-        if not qos_message.ack_received and packet.packet_id in self.pending_qos_messages:
-            qos_message.state = "EXPIRED"
-            del self.pending_qos_messages[packet.packet_id]
+        if qos_message.ack_received or packet_id not in self.pending_qos_messages:
+            self._discard_inflight(packet_id)
+        elif qos_message.retry_count >= self.max_retries:
+            qos_message.state = QoSState.EXPIRED
+            qos_message.timeout_occurred = True
+            del self.pending_qos_messages[packet_id]
+            self._discard_inflight(packet_id)
+            self._free_packet_id(packet_id)
+        else:
+            self._wheel_add(packet_id)
+
+    def _complete(self, packet_id: int) -> None:
+        """Mark a message delivered and release its tracking state"""
+        qos_message = self.pending_qos_messages.pop(packet_id, None)
+        if qos_message is not None:
+            qos_message.ack_received = True
+            qos_message.state = QoSState.COMPLETED
+            self._discard_inflight(packet_id)
+            self._free_packet_id(packet_id)
 
     async def handle_puback(self, packet_id: int) -> None:
         """Handle PUBACK packet for QoS 1"""
-        if packet_id in self.pending_qos_messages:
-            qos_message = self.pending_qos_messages[packet_id]
-            qos_message.ack_received = True
-            qos_message.state = "COMPLETED"
-            del self.pending_qos_messages[packet_id]
+        self._complete(packet_id)
+
+    def handle_pubacks(self, packet_ids: Iterable[int]) -> None:
+        """Handle a batch of PUBACK packets for QoS 1 in one call"""
+        for packet_id in packet_ids:
+            self._complete(packet_id)
 
     async def handle_pubrec(self, packet_id: int) -> None:
         """Handle PUBREC packet for QoS 2 - first phase"""
         if packet_id in self.pending_qos_messages:
             qos_message = self.pending_qos_messages[packet_id]
-            qos_message.state = "PUBREC_RECEIVED"
+            qos_message.state = QoSState.PUBREC_RECEIVED
             # Send PUBREL
             # Note: Actual network transmission would be handled by a connection manager
 
     async def handle_pubcomp(self, packet_id: int) -> None:
         """Handle PUBCOMP packet for QoS 2 - final phase"""
-        if packet_id in self.pending_qos_messages:
-            qos_message = self.pending_qos_messages[packet_id]
-            qos_message.ack_received = True
-            qos_message.state = "COMPLETED"
-            del self.pending_qos_messages[packet_id]
\ No newline at end of file
+        self._complete(packet_id)
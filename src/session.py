@@ -1,21 +1,248 @@
+import json
+import sys
+from array import array
+from collections.abc import MutableMapping
 from dataclasses import dataclass
-from datetime import datetime
-from typing import Dict, Optional
+from enum import IntEnum, unique
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Final, Iterable, Iterator, List, Optional, Tuple, Union
 from .will_message import QoSLevel
 
-@dataclass
+try:
+    import orjson
+except ImportError:  # Optional: fall back to the standard library encoder
+    orjson = None
+
+# Clock used for expiry checks; tests patch this instead of the system clock
+_now = datetime.now
+
+@unique
+class QoSState(IntEnum):
+    """Delivery state of a QoS 1/2 message"""
+    PENDING = 0
+    PUBREC_RECEIVED = 1
+    PUBREL_SENT = 2
+    PUBREL_RECEIVED = 3
+    PUBCOMP_RECEIVED = 4
+    RETRANSMITTED = 5
+    RETRANSMISSION_FAILED = 6
+    COMPLETED = 7
+    EXPIRED = 8
+
+    def __str__(self) -> str:
+        return self.name
+
+_QOS_LEVELS = tuple(QoSLevel)
+_QOS_TO_INT: Final[Dict[QoSLevel, int]] = {q: q.value for q in QoSLevel}
+
+class _TrieNode:
+    """Topic filter trie node holding the QoS of the filter ending here"""
+    __slots__ = ('children', 'qos')
+
+    def __init__(self):
+        self.children: Dict[str, '_TrieNode'] = {}
+        self.qos = -1  # No filter ends at this node
+
+class SubscriptionTable(MutableMapping):
+    """Topic filter to QoS mapping stored as parallel topic and QoS arrays"""
+    __slots__ = ('_topics', '_qos', '_index', '_trie', '_shared', 'observer')
+
+    def __init__(self, subscriptions: Union[Dict[str, QoSLevel], Iterable[Tuple[str, QoSLevel]], None] = None):
+        self._topics: List[str] = []
+        self._qos = array('B')
+        self._index: Dict[str, int] = {}
+        self._trie: Optional[_TrieNode] = None  # Built on first match()
+        self._shared = False  # Storage may be shared with a copy; detach before writing
+        # Called with (topic, qos) after every change, qos None for a removal
+        self.observer: Optional[Callable[[str, Optional[QoSLevel]], None]] = None
+        if subscriptions:
+            self.update(subscriptions)
+
+    def __getitem__(self, topic: str) -> QoSLevel:
+        return _QOS_LEVELS[self._qos[self._index[topic]]]
+
+    def __setitem__(self, topic: str, qos: QoSLevel) -> None:
+        if self._shared:
+            self._detach()
+        self._trie = None
+        index = self._index.get(topic)
+        if index is None:
+            # Interned so the table shares filter strings with the topic tree
+            topic = sys.intern(topic)
+            self._index[topic] = len(self._topics)
+            self._topics.append(topic)
+            self._qos.append(qos)
+        else:
+            self._qos[index] = qos
+        if self.observer is not None:
+            self.observer(topic, qos)
+
+    def __delitem__(self, topic: str) -> None:
+        if topic not in self._index:
+            raise KeyError(topic)
+        if self._shared:
+            self._detach()
+        # Move the last entry into the freed slot to keep the arrays dense
+        index = self._index.pop(topic)
+        self._trie = None
+        last = len(self._topics) - 1
+        if index != last:
+            moved = self._topics[last]
+            self._topics[index] = moved
+            self._qos[index] = self._qos[last]
+            self._index[moved] = index
+        self._topics.pop()
+        self._qos.pop()
+        if self.observer is not None:
+            self.observer(topic, None)
+
+    def __contains__(self, topic: object) -> bool:
+        return topic in self._index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._topics)
+
+    def __len__(self) -> int:
+        return len(self._topics)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({dict(self.items())!r})"
+
+    def clear(self) -> None:
+        """Remove all subscriptions"""
+        topics = self._topics if self.observer is not None else ()
+        # Fresh storage instead of clearing in place, which also leaves any copy intact
+        self._topics = []
+        self._qos = array('B')
+        self._index = {}
+        self._trie = None
+        self._shared = False
+        for topic in topics:
+            self.observer(topic, None)
+
+    def copy(self) -> 'SubscriptionTable':
+        """Return a copy-on-write copy of the table, without its observer
+
+        Both tables share storage, and the built trie, until either one is written.
+        """
+        table = SubscriptionTable()
+        table._topics = self._topics
+        table._qos = self._qos
+        table._index = self._index
+        table._trie = self._trie
+        table._shared = self._shared = True
+        return table
+
+    def _detach(self) -> None:
+        """Take private copies of storage shared with another table"""
+        self._topics = self._topics.copy()
+        self._qos = array('B', self._qos)
+        self._index = self._index.copy()
+        self._shared = False
+
+    def _build_trie(self) -> _TrieNode:
+        """Index the topic filters by segment for wildcard matching"""
+        root = _TrieNode()
+        for topic, qos in zip(self._topics, self._qos):
+            node = root
+            for segment in topic.split('/'):
+                child = node.children.get(segment)
+                if child is None:
+                    child = node.children[segment] = _TrieNode()
+                node = child
+            node.qos = qos
+        self._trie = root
+        return root
+
+    def match(self, topic: str) -> Optional[QoSLevel]:
+        """Return the highest QoS among filters matching a topic name, or None"""
+        root = self._trie or self._build_trie()
+        segments = topic.split('/')
+        depth_end = len(segments)
+        # Wildcards at the first level never match topics starting with '$'
+        system_topic = topic.startswith('$')
+        best = -1
+        stack = [(root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            wildcards = not (system_topic and depth == 0)
+            if wildcards:
+                # '#' also matches the parent level itself
+                multi = node.children.get('#')
+                if multi is not None and multi.qos > best:
+                    best = multi.qos
+            if depth == depth_end:
+                if node.qos > best:
+                    best = node.qos
+                continue
+            child = node.children.get(segments[depth])
+            if child is not None:
+                stack.append((child, depth + 1))
+            if wildcards:
+                single = node.children.get('+')
+                if single is not None:
+                    stack.append((single, depth + 1))
+        return _QOS_LEVELS[best] if best >= 0 else None
+
+@dataclass(slots=True)
 class SessionState:
+    """Client session; subscriptions are always copied into a table the session owns"""
     client_id: str
     clean_session: bool
-    subscriptions: Dict[str, QoSLevel]
+    subscriptions: SubscriptionTable
     pending_messages: Dict[int, 'QoSMessage']
     timestamp: datetime
 
-@dataclass
+    def __post_init__(self):
+        # Never alias the caller's mapping, whether a dict or another session's table;
+        # a table copy is copy-on-write, so restoring a session does not copy filters
+        if isinstance(self.subscriptions, SubscriptionTable):
+            self.subscriptions = self.subscriptions.copy()
+        else:
+            self.subscriptions = SubscriptionTable(self.subscriptions)
+
+    def is_expired(self, expiry: timedelta) -> bool:
+        """Check whether the session is older than the expiry interval"""
+        return _now() - self.timestamp > expiry
+
+    def to_json(self) -> bytes:
+        """Serialize the persistent session fields to UTF-8 JSON"""
+        data = {
+            'client_id': self.client_id,
+            'clean_session': self.clean_session,
+            'subscriptions': {topic: _QOS_TO_INT[qos] for topic, qos in self.subscriptions.items()},
+            'timestamp': self.timestamp,
+        }
+        if orjson is not None:
+            return orjson.dumps(data)
+        data['timestamp'] = self.timestamp.isoformat()
+        # Same bytes as orjson: compact, with non-ASCII text left as raw UTF-8
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def cleanup_pending_messages(self, expiry: timedelta) -> None:
+        """Drop acknowledged and expired pending messages in a single pass"""
+        # Compare timestamps against one cutoff instead of building a timedelta per message
+        cutoff = _now() - expiry
+        survivors = {
+            message_id: message
+            for message_id, message in self.pending_messages.items()
+            if not message.ack_received and message.timestamp >= cutoff
+        }
+        # Refill in place so references to the dict stay valid
+        self.pending_messages.clear()
+        self.pending_messages.update(survivors)
+
+@dataclass(slots=True)
 class QoSMessage:
     message_id: int
     qos_level: QoSLevel
     timestamp: datetime
     retry_count: int = 0
-    state: str = "PENDING"
-    ack_received: bool = False
\ No newline at end of file
+    state: QoSState = QoSState.PENDING
+    ack_received: bool = False
+    last_sent: Optional[datetime] = None
+    timeout_occurred: bool = False
+
+    def is_expired(self, expiry: timedelta) -> bool:
+        """Check whether the message is older than the expiry interval"""
+        return _now() - self.timestamp > expiry
@@ -1,12 +1,25 @@
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping
 from dataclasses import dataclass
 from enum import IntEnum
-from typing import Dict, List, Set, Optional
+from functools import partial
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 import asyncio
+import struct
+import sys
 from datetime import datetime
 
-from .session import SessionState, QoSMessage
+from .publish import _encode_remaining_length
+from .session import SessionState, QoSMessage, SubscriptionTable
 from .will_message import QoSLevel
 
+_UINT16 = struct.Struct('!H')
+_QOS_LEVELS = tuple(QoSLevel)
+
+# Number of topics whose matches are remembered between subscription changes
+MATCH_CACHE_SIZE = 10000
+
 class MessageType(IntEnum):
     SUBSCRIBE = 8
     SUBACK = 9
@@ -18,148 +31,421 @@ class SubscribePacket:
     
     def encode(self) -> bytes:
         """Encode SUBSCRIBE packet to bytes"""
-        # Variable header
-        packet = bytearray()
-        # Packet identifier (2 bytes)
-        packet.extend(self.packet_id.to_bytes(2, 'big'))
-        
-        # Payload - topic filters and QoS
-        for topic, qos in self.topic_filters:
-            # Topic length (2 bytes) + topic + QoS (1 byte)
-            packet.extend(len(topic).to_bytes(2, 'big'))
-            packet.extend(topic.encode())
-            packet.extend(bytes([qos]))
-        
-        # Fixed header
-        fixed_header = bytearray([MessageType.SUBSCRIBE << 4 | 0x02])  # QoS=1 required
-        # Remaining length
-        remaining_length = len(packet)
-        while remaining_length > 0:
-            byte = remaining_length & 0x7F
-            remaining_length >>= 7
-            if remaining_length > 0:
-                byte |= 0x80
-            fixed_header.append(byte)
+        topics = [topic.encode('utf-8') for topic, _ in self.topic_filters]
+        # Packet identifier (2 bytes), then length prefix + topic + QoS per filter
+        remaining_length = 2 + sum(len(topic) + 3 for topic in topics)
+        
+        # Fixed header, QoS=1 required
+        fixed_header = bytes([MessageType.SUBSCRIBE << 4 | 0x02]) + _encode_remaining_length(remaining_length)
+        offset = len(fixed_header)
+        
+        # Single allocation sized up front, filled in place
+        packet = bytearray(offset + remaining_length)
+        packet[:offset] = fixed_header
+        _UINT16.pack_into(packet, offset, self.packet_id)
+        offset += 2
+        for topic, (_, qos) in zip(topics, self.topic_filters):
+            end = offset + 2 + len(topic)
+            _UINT16.pack_into(packet, offset, len(topic))
+            packet[offset + 2:end] = topic
+            packet[end] = qos
+            offset = end + 1
             
-        return bytes(fixed_header + packet)
+        return bytes(packet)
 
-@dataclass
+def validate_topic_filter(topic: str) -> bool:
+    """
+    Validate topic filter according to MQTT rules, using C-level string scans:
+    - Single-level wildcard (+) can be used at any level but must occupy entire level
+    - Multi-level wildcard (#) must be the last character
+    - Neither wildcard can be used within a level
+    """
+    if not topic:
+        return False
+    
+    # Empty level (leading, trailing or double slash) is invalid
+    if topic[0] == '/' or topic[-1] == '/' or '//' in topic:
+        return False
+    
+    # '#' must be alone and at last position
+    hash_idx = topic.find('#')
+    if hash_idx != -1:
+        if hash_idx != len(topic) - 1 or (hash_idx > 0 and topic[hash_idx - 1] != '/'):
+            return False
+    
+    # '+' must occupy entire level; only filters using it pay for the split
+    if '+' in topic:
+        return all(level == '+' for level in topic.split('/') if '+' in level)
+    return True
+
+@dataclass(frozen=True, slots=True)
+class TopicPath:
+    """Topic filter split into levels once, with its wildcard layout"""
+    topic: str
+    parts: Tuple[str, ...]
+    has_wild: bool
+    hash_idx: int  # Level of the '#' wildcard, or -1
+    depth: int
+
+    @classmethod
+    def from_parts(cls, parts: Union[List[str], Tuple[str, ...]]) -> 'TopicPath':
+        """Build a path from already split levels without validating them"""
+        parts = tuple(parts)
+        hash_idx = parts.index('#') if '#' in parts else -1
+        has_wild = hash_idx >= 0 or '+' in parts
+        return cls('/'.join(parts), parts, has_wild, hash_idx, len(parts))
+
+    @classmethod
+    def parse(cls, topic: str) -> Optional['TopicPath']:
+        """Split and validate a topic filter, returning None if it is invalid"""
+        if not validate_topic_filter(topic):
+            return None
+        parts = tuple(topic.split('/'))
+        hash_idx = len(parts) - 1 if topic[-1] == '#' else -1
+        has_wild = hash_idx >= 0 or '+' in topic
+        return cls(topic, parts, has_wild, hash_idx, len(parts))
+
+class NodeSubscribers(Mapping):
+    """Client ID to QoS mapping stored as parallel client and QoS arrays"""
+    __slots__ = ('_ids', '_qos', '_pos')
+
+    def __init__(self):
+        self._ids: List[str] = []
+        self._qos = bytearray()
+        self._pos: Dict[str, int] = {}
+
+    def __getitem__(self, client_id: str) -> QoSLevel:
+        return _QOS_LEVELS[self._qos[self._pos[client_id]]]
+
+    def __contains__(self, client_id: object) -> bool:
+        return client_id in self._pos
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._ids)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({dict(self.items())!r})"
+
+    def items(self):
+        """Return (client ID, QoS) pairs straight from the arrays"""
+        return zip(self._ids, map(_QOS_LEVELS.__getitem__, self._qos))
+
+    def raw_items(self):
+        """Return (client ID, QoS as int) pairs without building enum members"""
+        return zip(self._ids, self._qos)
+
+    def set(self, client_id: str, qos: QoSLevel) -> bool:
+        """Add a subscriber or replace its granted QoS; return True if it was new"""
+        pos = self._pos.setdefault(client_id, len(self._ids))
+        if pos == len(self._ids):
+            self._ids.append(client_id)
+            self._qos.append(qos)
+            return True
+        self._qos[pos] = qos
+        return False
+
+    def discard(self, client_id: str) -> None:
+        """Remove a subscriber if present"""
+        # Move the last entry into the freed slot to keep the arrays dense
+        pos = self._pos.pop(client_id, None)
+        if pos is None:
+            return
+        last = len(self._ids) - 1
+        if pos != last:
+            moved = self._ids[last]
+            self._ids[pos] = moved
+            self._qos[pos] = self._qos[last]
+            self._pos[moved] = pos
+        self._ids.pop()
+        self._qos.pop()
+
+@dataclass(slots=True)
 class TopicNode:
     segment: str
     children: Dict[str, 'TopicNode']
-    subscribers: Set[str]  # Set of client IDs
-    qos_levels: Dict[str, QoSLevel]  # Map client ID to QoS
+    subscribers: NodeSubscribers  # Client ID -> QoS of filters ending here
     is_wildcard: bool
+    level_mask: int  # Bit k set if a wildcard filter ends k levels below this node
+    has_hash: bool  # A '#' filter lies below, so any remaining depth can match
     
     def __init__(self, segment: str):
         self.segment = segment
         self.children = {}
-        self.subscribers = set()
-        self.qos_levels = {}
+        self.subscribers = NodeSubscribers()
         self.is_wildcard = '#' in segment or '+' in segment
+        self.level_mask = 0
+        self.has_hash = False
+
+class SessionMap(dict):
+    """Session table that keeps the topic tree in step with the sessions it holds"""
+    __slots__ = ('_on_add', '_on_remove')
+
+    def __init__(self, on_add, on_remove, *args, **kwargs):
+        super().__init__()
+        self._on_add = on_add
+        self._on_remove = on_remove
+        self.update(*args, **kwargs)
+
+    def __setitem__(self, client_id: str, session: SessionState) -> None:
+        previous = self.get(client_id)
+        if previous is session:
+            return
+        super().__setitem__(client_id, session)
+        if previous is not None:
+            self._on_remove(client_id, previous)
+        self._on_add(client_id, session)
+
+    def __delitem__(self, client_id: str) -> None:
+        session = super().pop(client_id)
+        self._on_remove(client_id, session)
+
+    def pop(self, client_id: str, *default):
+        if client_id not in self:
+            return super().pop(client_id, *default)
+        session = super().pop(client_id)
+        self._on_remove(client_id, session)
+        return session
+
+    def popitem(self):
+        client_id, session = super().popitem()
+        self._on_remove(client_id, session)
+        return client_id, session
+
+    def setdefault(self, client_id: str, session: SessionState = None):
+        if client_id not in self:
+            self[client_id] = session
+        return self[client_id]
+
+    def update(self, *args, **kwargs) -> None:
+        for client_id, session in dict(*args, **kwargs).items():
+            self[client_id] = session
+
+    def clear(self) -> None:
+        removed = list(self.items())
+        super().clear()
+        for client_id, session in removed:
+            self._on_remove(client_id, session)
 
 class SubscriptionHandler:
     def __init__(self):
         self.topic_tree = TopicNode('')
-        self.sessions: Dict[str, SessionState] = {}
+        self._sessions = SessionMap(self._index_session, self._unindex_session)
+        # Client ID -> filter -> (parsed filter, leaf node) of each of its subscriptions
+        self._by_client: Dict[str, Dict[str, Tuple[TopicPath, TopicNode]]] = {}
+        # Filters without wildcards, keyed by the full filter: client ID -> QoS
+        self._exact: Dict[str, Dict[str, QoSLevel]] = {}
+        # Topic -> final subscriber QoS; cleared on any subscription or session change
+        self._match_cache: 'OrderedDict[str, Dict[str, QoSLevel]]' = OrderedDict()
         
+    @property
+    def sessions(self) -> Dict[str, SessionState]:
+        """Client ID -> session; adding, replacing or removing one updates the topic tree"""
+        return self._sessions
+
+    @sessions.setter
+    def sessions(self, sessions: Dict[str, SessionState]) -> None:
+        # Assigning a plain dict still goes through SessionMap
+        self._sessions.clear()
+        self._sessions.update(sessions)
+
+    def _index_session(self, client_id: str, session: SessionState) -> None:
+        """Add the subscriptions a session already holds to the topic tree"""
+        self._match_cache.clear()
+        subscriptions = getattr(session, 'subscriptions', None)
+        if isinstance(subscriptions, SubscriptionTable):
+            # Later edits to the session's own table reach the tree through its hook
+            subscriptions.observer = partial(self._on_subscription_change, client_id)
+        if not isinstance(subscriptions, Mapping):
+            return
+        filters = []
+        for topic, qos in subscriptions.items():
+            path = TopicPath.parse(topic)
+            if path is not None:
+                filters.append((path, qos))
+        if filters:
+            self._add_topic_nodes(client_id, filters)
+
+    def _unindex_session(self, client_id: str, session: SessionState) -> None:
+        """Detach a removed session and drop its client's subscriptions"""
+        self._match_cache.clear()
+        subscriptions = getattr(session, 'subscriptions', None)
+        if isinstance(subscriptions, SubscriptionTable):
+            subscriptions.observer = None
+        self._drop_subscriptions(client_id)
+
+    def _on_subscription_change(self, client_id: str, topic: str, qos: Optional[QoSLevel]) -> None:
+        """Apply one change made directly to a session's subscription table"""
+        if qos is None:
+            self._drop_subscription(client_id, topic)
+            return
+        indexed = self._by_client.get(client_id, {}).get(topic)
+        if indexed is not None and indexed[1].subscribers.get(client_id) == qos:
+            return  # Already in the tree, e.g. inserted by handle_subscribe
+        path = TopicPath.parse(topic)
+        if path is not None:
+            self._add_topic_node(path, client_id, qos)
+
     def _split_topic(self, topic: str) -> List[str]:
         return topic.split('/')
     
-    def _add_topic_node(self, segments: List[str], client_id: str, qos: QoSLevel, node: TopicNode = None) -> None:
+    def _add_topic_node(self, path: Union[TopicPath, List[str]], client_id: str, qos: QoSLevel, node: TopicNode = None) -> None:
         """Add topic subscription to topic tree and manage subscription state
     
         Args:
-            segments: Remaining segments of the topic filter
+            path: Parsed topic filter, or its segments
             client_id: Client ID to subscribe
             qos: QoS level for the subscription
-            node: Current node in topic tree (None for root)
+            node: Node to insert below (None for root)
         """
         # Initialize root node if needed
         if node is None:
             node = self.topic_tree
         
-        # Base case: empty segments
-        if not segments:
-            node.subscribers.add(client_id)
-            node.qos_levels[client_id] = qos
-            return
+        # Any new subscription invalidates remembered matches
+        self._match_cache.clear()
+        
+        if not isinstance(path, TopicPath):
+            path = TopicPath.from_parts(path)
+        
+        nodes = [node]
+        for segment in path.parts:
+            node = self._get_child(node, segment)
+            nodes.append(node)
+        self._register_filter(path, client_id, qos, nodes)
     
-        # Get current segment
-        segment = segments[0]
+    def _add_topic_nodes(self, client_id: str, filters: List[Tuple[TopicPath, QoSLevel]]) -> None:
+        """Insert several parsed filters, sharing the tree walk across common prefixes"""
+        self._match_cache.clear()
+        
+        # nodes[i] is the node reached after i levels of the previous filter
+        nodes = [self.topic_tree]
+        previous: Tuple[str, ...] = ()
+        # Stable sort: a filter repeated in one packet still ends with its last QoS
+        for path, qos in sorted(filters, key=lambda f: f[0].parts):
+            parts = path.parts
+            shared = 0
+            limit = min(len(parts), len(previous))
+            while shared < limit and parts[shared] == previous[shared]:
+                shared += 1
+            
+            # Only descend from where this filter leaves the previous one
+            del nodes[shared + 1:]
+            node = nodes[-1]
+            for segment in parts[shared:]:
+                node = self._get_child(node, segment)
+                nodes.append(node)
+            self._register_filter(path, client_id, qos, nodes)
+            previous = parts
     
-        # Create new node if needed
-        if segment not in node.children:
-            node.children[segment] = TopicNode(segment)
+    def _get_child(self, node: TopicNode, segment: str) -> TopicNode:
+        """Return the child node for a segment, creating it if needed"""
+        child = node.children.get(segment)
+        if child is None:
+            # Interned so every node and filter shares one object per segment
+            segment = sys.intern(segment)
+            child = node.children[segment] = TopicNode(segment)
+        return child
     
-        # Handle wildcard subscription
-        if segment == '#':
-            # MQTT spec: '#' must be the last segment
-            node.subscribers.add(client_id)
-            node.qos_levels[client_id] = qos
-            return
+    def _register_filter(self, path: TopicPath, client_id: str, qos: QoSLevel, nodes: List[TopicNode]) -> None:
+        """Record a subscription on the nodes along its path, ending at its leaf"""
+        wildcard = path.has_wild
+        if not wildcard and nodes[0] is self.topic_tree:
+            # Exact filters are also served by a single hash lookup
+            self._exact.setdefault(sys.intern(path.topic), {})[client_id] = qos
         
-        # Handle single level wildcard subscription
-        if segment == '+':
-            node.subscribers.add(client_id)
-            node.qos_levels[client_id] = qos
+        # Only paths leading to wildcard filters need the tree walk when matching,
+        # and only for topics deep enough to reach the end of one
+        if path.hash_idx >= 0:
+            for node in nodes:
+                node.has_hash = True
+        elif wildcard:
+            remaining = path.depth
+            for node in nodes:
+                node.level_mask |= 1 << remaining
+                remaining -= 1
         
-        # Recursive case: continue with remaining segments
-        self._add_topic_node(segments[1:], client_id, qos, node.children[segment])
+        # The filter ends here, including '+' and '#' leaves
+        leaf = nodes[-1]
+        leaf.subscribers.set(client_id, qos)
+        self._by_client.setdefault(client_id, {})[path.topic] = (path, leaf)
     
-    def _match_topic(self, pattern: List[str], topic: List[str], node: TopicNode = None) -> Set[str]:
-        """Match topic against pattern, return matching subscribers"""
-        if node is None:
-            node = self.topic_tree
+    def _unregister_filter(self, client_id: str, path: TopicPath, leaf: TopicNode) -> None:
+        """Remove one subscription from its leaf and from the exact index"""
+        leaf.subscribers.discard(client_id)
+        exact = self._exact.get(path.topic) if not path.has_wild else None
+        if exact is not None:
+            exact.pop(client_id, None)
+            if not exact:
+                del self._exact[path.topic]
+        # Level masks are left in place: they only let the matcher skip subtrees
+    
+    def _drop_subscription(self, client_id: str, topic: str) -> None:
+        """Remove a single subscription of a client"""
+        subscriptions = self._by_client.get(client_id)
+        indexed = subscriptions.pop(topic, None) if subscriptions else None
+        if indexed is None:
+            return
+        self._match_cache.clear()
+        self._unregister_filter(client_id, *indexed)
+        if not subscriptions:
+            del self._by_client[client_id]
+    
+    def _drop_subscriptions(self, client_id: str) -> None:
+        """Remove every subscription of a client, visiting only its own leaves"""
+        subscriptions = self._by_client.pop(client_id, None)
+        if not subscriptions:
+            return
+        self._match_cache.clear()
+        for path, leaf in subscriptions.values():
+            self._unregister_filter(client_id, path, leaf)
+
+    def remove_session(self, client_id: str) -> None:
+        """Forget a client's session and all of its subscriptions"""
+        self.sessions.pop(client_id, None)
+        self._drop_subscriptions(client_id)
+    
+    def _match_topic(self, topic: List[str]) -> List[TopicNode]:
+        """Return the tree nodes whose filters match the topic segments"""
+        matched = []
+        depth_end = len(topic)
+        # Wildcards at the first level never match topics starting with '$'
+        system_topic = topic[0].startswith('$')
+        
+        # Explicit stack instead of recursion: no Python frame per level
+        stack = [(self.topic_tree, 0)]
+        while stack:
+            node, depth = stack.pop()
+            children = node.children
+            wildcards = depth > 0 or not system_topic
             
-        if not pattern or not topic:
-            return node.subscribers
+            # '#' matches the remaining levels, including the parent level itself
+            if wildcards:
+                child = children.get('#')
+                if child is not None:
+                    matched.append(child)
+            if depth == depth_end:
+                matched.append(node)
+                continue
             
-        matched_subscribers = set()
-        
-        # Handle wildcards
-        if pattern[0] == '#':
-            return node.subscribers
-        elif pattern[0] == '+':
-            for child in node.children.values():
-                matched_subscribers.update(
-                    self._match_topic(pattern[1:], topic[1:], child)
-                )
-        elif pattern[0] in node.children:
-            if pattern[0] == topic[0]:
-                matched_subscribers.update(
-                    self._match_topic(pattern[1:], topic[1:], node.children[pattern[0]])
-                )
+            # Skip subtrees where no wildcard filter ends at the topic's depth;
+            # exact filters are answered by the exact index
+            remaining = depth_end - depth - 1
+            child = children.get(topic[depth])
+            if child is not None and (child.has_hash or child.level_mask >> remaining & 1):
+                stack.append((child, depth + 1))
+            if wildcards:
+                child = children.get('+')
+                if child is not None and (child.has_hash or child.level_mask >> remaining & 1):
+                    stack.append((child, depth + 1))
                 
-        return matched_subscribers
+        return matched
 
     def _validate_topic_filter(self, topic: str) -> bool:
-        """
-        Validate topic filter according to MQTT rules:
-        - Single-level wildcard (+) can be used at any level but must occupy entire level
-        - Multi-level wildcard (#) must be the last character
-        - Neither wildcard can be used within a level
-        """
-        if not topic:
-            return False
-            
-        segments = topic.split('/')
-        
-        # Check each segment
-        for i, segment in enumerate(segments):
-            # Empty segment (double slash) is invalid
-            if not segment:
-                return False
-                
-            # Check for invalid wildcard usage
-            if '+' in segment and segment != '+':
-                return False  # + must occupy entire level
-                
-            if '#' in segment:
-                if segment != '#' or i != len(segments) - 1:
-                    return False  # # must be alone and at last position
-                    
-        return True
+        """Validate topic filter according to MQTT rules"""
+        return validate_topic_filter(topic)
         
     def _validate_qos(self, qos: int) -> bool:
         """Validate QoS level is 0, 1, or 2"""
@@ -171,6 +457,7 @@ class SubscriptionHandler:
         Returns a list of granted QoS levels or failure codes (0x80).
         """
         return_codes = []
+        accepted: List[Tuple[TopicPath, QoSLevel]] = []
         
         for topic, qos in packet.topic_filters:
             # Validate QoS level
@@ -178,57 +465,84 @@ class SubscriptionHandler:
                 return_codes.append(0x80)  # Failure
                 continue
                 
-            # Validate topic filter
-            if not self._validate_topic_filter(topic):
+            # Validate topic filter, splitting it once for the tree insert
+            path = TopicPath.parse(topic)
+            if path is None:
                 return_codes.append(0x80)  # Failure
                 continue
-                
-            # Add subscription to topic tree
-            segments = self._split_topic(topic)
-            self._add_topic_node(segments, client_id, qos)
-            
-            # Update session state
-            if client_id in self.sessions:
-                self.sessions[client_id].subscriptions[topic] = qos
+            accepted.append((path, qos))
                 
             # Add granted QoS to return codes
             return_codes.append(qos)
+        
+        # Add all accepted subscriptions to the topic tree in one sorted pass
+        if accepted:
+            self._add_topic_nodes(client_id, accepted)
+            
+            # Update session state; its table hook finds the filters already indexed
+            session = self.sessions.get(client_id)
+            if session is not None:
+                for path, qos in accepted:
+                    session.subscriptions[path.topic] = qos
             
         return return_codes
         
     async def send_suback(self, writer: asyncio.StreamWriter, packet_id: int, return_codes: List[QoSLevel]) -> None:
         """Send SUBACK packet"""
-        # Variable header
-        packet = bytearray()
-        packet.extend(packet_id.to_bytes(2, 'big'))
-        
-        # Payload - return codes
-        packet.extend(bytes(return_codes))
-        
-        # Fixed header
-        fixed_header = bytearray([MessageType.SUBACK << 4])
-        # Remaining length
-        remaining_length = len(packet)
-        while remaining_length > 0:
-            byte = remaining_length & 0x7F
-            remaining_length >>= 7
-            if remaining_length > 0:
-                byte |= 0x80
-            fixed_header.append(byte)
+        # Packet identifier (2 bytes) + one return code per filter
+        remaining_length = 2 + len(return_codes)
+        fixed_header = bytes([MessageType.SUBACK << 4]) + _encode_remaining_length(remaining_length)
+        offset = len(fixed_header)
+        
+        # Single buffer: header, packet ID, then the codes copied in from a byte array
+        packet = bytearray(offset + remaining_length)
+        packet[:offset] = fixed_header
+        _UINT16.pack_into(packet, offset, packet_id)
+        packet[offset + 2:] = array('B', return_codes)
             
-        writer.write(bytes(fixed_header + packet))
+        writer.write(packet)
         await writer.drain()
         
+    def _collect_subscribers(self, topic: str) -> Dict[str, QoSLevel]:
+        """Return every client with a session matching a topic, with its highest QoS"""
+        # Exact filters first: a single dict lookup on the topic name
+        exact = self._exact.get(topic)
+        best: Dict[str, int] = dict(exact) if exact else {}
+        
+        # Then one walk over the wildcard part of the topic tree, merging plain ints
+        for node in self._match_topic(topic.split('/')):
+            for client_id, qos in node.subscribers.raw_items():
+                if qos > best.get(client_id, -1):
+                    best[client_id] = qos
+        
+        # Back to QoSLevel members only once per matched client; the tree may
+        # hold filters of clients subscribed without a session
+        sessions = self._sessions
+        return {
+            client_id: _QOS_LEVELS[qos] for client_id, qos in best.items()
+            if client_id in sessions
+        }
+
+    def _cached_matches(self, topic: str) -> Dict[str, QoSLevel]:
+        """Return the matches for a topic through the LRU cache"""
+        cache = self._match_cache
+        matches = cache.get(topic)
+        if matches is None:
+            matches = cache[topic] = self._collect_subscribers(topic)
+            if len(cache) > MATCH_CACHE_SIZE:
+                cache.popitem(last=False)
+        else:
+            cache.move_to_end(topic)
+        return matches
+
     def get_matching_subscribers(self, topic: str) -> Dict[str, QoSLevel]:
-        # """Get all subscribers matching a topic"""
-        topic_segments = topic.split('/')
-        result = {}
-
-        # Iterate through all clients and their subscriptions
-        for client_id, session in self.sessions.items():
-            # Check each subscription pattern for matches
-            for pattern, qos in session.subscriptions.items():
-                if self._match_topic(pattern.split('/'), topic_segments):
-                    result[client_id] = qos
-
-        return result
+        """Get all subscribers matching a topic, with the highest QoS per client
+
+        The returned mapping is shared with the match cache and must not be modified.
+        """
+        return self._cached_matches(topic)
+
+    def get_matching_subscribers_batch(self, topics: List[str]) -> List[Dict[str, QoSLevel]]:
+        """Get the matching subscribers for each topic of a publish burst, in order"""
+        # Repeated topics in a burst are answered by the match cache
+        return [self._cached_matches(topic) for topic in topics]
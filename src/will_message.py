@@ -1,12 +1,13 @@
 from dataclasses import dataclass
-from enum import IntEnum
+from enum import IntEnum, unique
 
+@unique
 class QoSLevel(IntEnum):
     AT_MOST_ONCE = 0
     AT_LEAST_ONCE = 1
     EXACTLY_ONCE = 2
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class WillMessage:
     topic: str
     payload: bytes
@@ -32,6 +33,6 @@ class WillMessage:
             
         if not isinstance(self.qos, QoSLevel):
             try:
-                self.qos = QoSLevel(self.qos)
+                object.__setattr__(self, 'qos', QoSLevel(self.qos))
             except ValueError:
                 raise ValueError(f"Invalid QoS value: {self.qos}. Must be 0, 1, or 2")
@@ -0,0 +1,11 @@
+import os
+import sys
+
+# Make the `src` package importable for every test module, once per session
+_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if _ROOT not in sys.path:
+    sys.path.insert(0, _ROOT)
+
+# Load the shared session/QoS modules once, before any test module is collected
+import src.session  # noqa: E402,F401
+import src.will_message  # noqa: E402,F401
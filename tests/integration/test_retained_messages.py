@@ -1,9 +1,8 @@
 import unittest
-from unittest.mock import Mock, patch
 import asyncio
-from datetime import datetime, timedelta
+from datetime import datetime
 
-from src.message_handler import MessageHandler, RetainedMessage
+from src.message_handler import MessageHandler
 from src.will_message import QoSLevel
 from src.publish import PublishPacket
 from src.subscribe import SubscribePacket
@@ -217,19 +216,30 @@ class TestRetainedMessagesIntegration(unittest.TestCase):
 
     def _topic_matches_wildcard(self, wildcard: str, topic: str) -> bool:
         """Helper method to check if topic matches wildcard pattern"""
-        wild_parts = wildcard.split('/')
-        topic_parts = topic.split('/')
-        
-        if len(wild_parts) > len(topic_parts) and '#' not in wild_parts:
-            return False
-            
-        for wild, topic in zip(wild_parts, topic_parts):
-            if wild == '#':
+        # Walk both names level by level on '/' offsets instead of splitting
+        wild, name = wildcard.encode(), topic.encode()
+        wild_end, name_end = len(wild), len(name)
+        wi = ti = 0
+
+        while True:
+            wj = wild.find(b'/', wi)
+            if wj < 0:
+                wj = wild_end
+            level = wild[wi:wj]
+            if level == b'#':
                 return True
-            if wild != '+' and wild != topic:
+            if ti > name_end:
                 return False
-                
-        return len(wild_parts) == len(topic_parts) or wild_parts[-1] == '#'
+
+            tj = name.find(b'/', ti)
+            if tj < 0:
+                tj = name_end
+            if level != b'+' and level != name[ti:tj]:
+                return False
+
+            if wj == wild_end:
+                return tj == name_end
+            wi, ti = wj + 1, tj + 1
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,23 +1,44 @@
 import unittest
-from unittest.mock import Mock, patch, AsyncMock
-from datetime import datetime, timedelta
-import asyncio
-
-# add src into path, src path upper level two from this file
-import sys
-import os
-# Add src into path, src path upper level two from this file
-sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+import dataclasses
+from datetime import datetime
 
 from src.message_handler import (
     MessageHandler, MessageQueue, Message, 
     RetainedMessage, QoSMessage
 )
 from src.will_message import QoSLevel
-from src.publish import PublishPacket
-from src.session import SessionState
+from src.publish import PublishHandler, PublishPacket
+from src.session import QoSState, SessionState
+
+# Fixed timestamp for fixtures whose time value is irrelevant to the test
+_TS = datetime(2024, 1, 1)
+
+# Base PUBLISH packet; tests copy it with dataclasses.replace before mutating
+_PUBLISH_TEMPLATE = PublishPacket(
+    topic="test/topic",
+    payload=b"test message",
+    qos=QoSLevel.AT_LEAST_ONCE,
+    retain=False,
+    packet_id=1
+)
+
+class _FakeSubscriptionHandler:
+    """Subscription handler stand-in with a fixed routing table"""
+    def get_matching_subscribers(self, topic):
+        return {
+            "client1": QoSLevel.AT_LEAST_ONCE,
+            "client2": QoSLevel.AT_MOST_ONCE
+        }
+
+class _FakePublishHandler:
+    """Publish handler stand-in handing out a fixed packet ID"""
+    def _get_next_packet_id(self):
+        return 1
 
-class TestMessageQueue(unittest.TestCase):
+    def _free_packet_id(self, packet_id):
+        pass
+
+class TestMessageQueue(unittest.IsolatedAsyncioTestCase):
     """Test suite for MessageQueue functionality"""
 
     def setUp(self):
@@ -31,8 +52,8 @@ class TestMessageQueue(unittest.TestCase):
             topic="test/topic",
             payload=b"test message",
             qos=QoSLevel.AT_LEAST_ONCE,
-            timestamp=datetime.now(),
-            last_modified=datetime.now()
+            timestamp=_TS,
+            last_modified=_TS
         )
         
         # Store message
@@ -49,13 +70,97 @@ class TestMessageQueue(unittest.TestCase):
         missing_msg = self.message_queue.get_retained_message("missing/topic")
         self.assertIsNone(missing_msg)
 
+    def test_retained_message_removal(self):
+        """Test empty payload clears a retained topic and keeps others intact"""
+        for index in range(3):
+            topic = f"test/topic{index}"
+            self.message_queue.store_retained_message(topic, RetainedMessage(
+                topic=topic,
+                payload=f"message {index}".encode(),
+                qos=QoSLevel.AT_LEAST_ONCE,
+                timestamp=_TS,
+                last_modified=_TS
+            ))
+
+        # Clearing a topic moves the last entry into its slot
+        self.message_queue.store_retained_message("test/topic0", RetainedMessage(
+            topic="test/topic0",
+            payload=b"",
+            qos=QoSLevel.AT_MOST_ONCE,
+            timestamp=_TS,
+            last_modified=_TS
+        ))
+
+        self.assertIsNone(self.message_queue.get_retained_message("test/topic0"))
+        self.assertEqual(
+            self.message_queue.get_retained_message("test/topic2").payload,
+            b"message 2"
+        )
+        self.assertEqual(
+            sorted(topic for topic, _, _ in self.message_queue.iter_retained()),
+            ["test/topic1", "test/topic2"]
+        )
+
+    def test_retained_batch_clear(self):
+        """Test clearing retained topics in small and large batches"""
+        topics = [f"test/topic{index}" for index in range(20)]
+        for topic in topics:
+            self.message_queue.store_retained_message(topic, RetainedMessage(
+                topic=topic,
+                payload=topic.encode(),
+                qos=QoSLevel.AT_MOST_ONCE,
+                timestamp=_TS,
+                last_modified=_TS
+            ))
+
+        # Small batch is removed topic by topic, unknown topics are ignored
+        self.message_queue.clear_retained_batch(topics[:2] + ["missing/topic"])
+        # Large batch rebuilds the store in one pass
+        self.message_queue.clear_retained_batch(topics[2:19])
+
+        self.assertEqual(
+            [topic for topic, _, _ in self.message_queue.iter_retained()],
+            topics[19:]
+        )
+        self.assertEqual(
+            self.message_queue.get_retained_message(topics[19]).payload,
+            topics[19].encode()
+        )
+        self.assertIsNone(self.message_queue.get_retained_message(topics[0]))
+
+    def test_retained_messages_view(self):
+        """Test retained_messages is a live view that rejects writes"""
+        view = self.message_queue.retained_messages
+        self.assertEqual(len(view), 0)
+        
+        retained_msg = RetainedMessage(
+            topic="test/topic",
+            payload=b"retained",
+            qos=QoSLevel.AT_LEAST_ONCE,
+            timestamp=_TS,
+            last_modified=_TS
+        )
+        self.message_queue.store_retained_message("test/topic", retained_msg)
+        self.assertEqual(view["test/topic"], retained_msg)
+        self.assertEqual(list(view), ["test/topic"])
+        
+        with self.assertRaises(TypeError):
+            view["other/topic"] = retained_msg
+        with self.assertRaises(TypeError):
+            del view["test/topic"]
+        with self.assertRaises(AttributeError):
+            view.clear()
+        
+        self.message_queue.clear_retained()
+        self.assertNotIn("test/topic", view)
+
     def test_inflight_message_tracking(self):
         """Test tracking of inflight QoS messages"""
         # Create QoS message
         qos_msg = QoSMessage(
             message_id=1,
             qos_level=QoSLevel.AT_LEAST_ONCE,
-            timestamp=datetime.now()
+            timestamp=_TS
         )
         
         # Track message
@@ -69,54 +174,38 @@ class TestMessageQueue(unittest.TestCase):
         self.assertEqual(tracked_msg.message_id, 1)
         self.assertEqual(tracked_msg.qos_level, QoSLevel.AT_LEAST_ONCE)
 
-    @patch('asyncio.Queue')
-    def test_message_queue_operations(self, mock_queue):
+    async def test_message_queue_operations(self):
         """Test async queue operations"""
-        mock_queue_instance = AsyncMock()
-        mock_queue.return_value = mock_queue_instance
-        
-        message_queue = MessageQueue()
         test_message = Message(type=1)
         
         # Test put operation
-        asyncio.run(message_queue.put(test_message))
-        mock_queue_instance.put.assert_called_once_with(test_message)
+        await self.message_queue.put(test_message)
+        self.assertEqual(self.message_queue.queue.qsize(), 1)
         
         # Test get operation
-        asyncio.run(message_queue.get())
-        mock_queue_instance.get.assert_called_once()
+        retrieved = await self.message_queue.get()
+        self.assertIs(retrieved, test_message)
+        self.assertTrue(self.message_queue.queue.empty())
 
-class TestMessageHandler(unittest.TestCase):
+# One handler per test rather than per class: it owns asyncio queues and tasks
+# that belong to the event loop of the test that created them
+class TestMessageHandler(unittest.IsolatedAsyncioTestCase):
     """Test suite for MessageHandler functionality"""
 
-    def setUp(self):
-        """Set up test fixtures"""
+    async def asyncSetUp(self):
+        """Build a fresh handler on each test's own event loop"""
         self.message_handler = MessageHandler()
+        self.message_handler.subscription_handler = _FakeSubscriptionHandler()
+        self.message_handler.publish_handler = _FakePublishHandler()
+
+    async def asyncTearDown(self):
+        """Cancel retry tasks the test left running"""
+        await self.message_handler.stop()
         
-    @patch('src.message_handler.PublishHandler')
-    @patch('src.message_handler.SubscriptionHandler')
-    # @patch('src.message_handler.Subscriber')
-    def test_publish_message_routing(self, mock_sub_handler, mock_pub_handler):
+    async def test_publish_message_routing(self):
         """Test routing of publish messages to subscribers"""
-        # Setup mocks
-        mock_sub_handler.return_value.get_matching_subscribers.return_value = {
-            "client1": QoSLevel.AT_LEAST_ONCE,
-            "client2": QoSLevel.AT_MOST_ONCE
-        }
-        mock_pub_handler.return_value._get_next_packet_id.return_value = 1
-        
-        # Create MessageHandler instance
-        self.message_handler.subscription_handler = mock_sub_handler.return_value
-        self.message_handler.publish_handler = mock_pub_handler.return_value
-
         # Create publish packet
-        publish_packet = PublishPacket(
-            topic="test/topic",
-            payload=b"test message",
-            qos=QoSLevel.AT_LEAST_ONCE,
-            retain=True,
-            packet_id=1
-        )
+        publish_packet = dataclasses.replace(_PUBLISH_TEMPLATE, retain=True)
         
         # Create test sessions
         self.message_handler.sessions = {
@@ -125,19 +214,19 @@ class TestMessageHandler(unittest.TestCase):
                 clean_session=True,
                 subscriptions={},
                 pending_messages={},
-                timestamp=datetime.now()
+                timestamp=_TS
             ),
             "client2": SessionState(
                 client_id="client2",
                 clean_session=True,
                 subscriptions={},
                 pending_messages={},
-                timestamp=datetime.now()
+                timestamp=_TS
             )
         }
         
         # Process publish packet
-        asyncio.run(self.message_handler._handle_publish(publish_packet))
+        await self.message_handler._handle_publish(publish_packet)
         
         # Verify retained message storage
         retained_msg = self.message_handler.message_queue.get_retained_message("test/topic")
@@ -153,22 +242,17 @@ class TestMessageHandler(unittest.TestCase):
         client2_session = self.message_handler.sessions["client2"]
         self.assertEqual(len(client2_session.pending_messages), 0)
 
-    @patch('asyncio.sleep')
-    async def test_qos_retry_mechanism(self, mock_sleep):
+    async def test_qos_retry_mechanism(self):
         """Test QoS message retry mechanism"""
         # Setup test data
         client_id = "test_client"
         qos_msg = QoSMessage(
             message_id=1,
             qos_level=QoSLevel.EXACTLY_ONCE,
-            timestamp=datetime.now()
+            timestamp=_TS
         )
-        publish_packet = PublishPacket(
-            topic="test/topic",
-            payload=b"test message",
-            qos=QoSLevel.EXACTLY_ONCE,
-            retain=False,
-            packet_id=1
+        publish_packet = dataclasses.replace(
+            _PUBLISH_TEMPLATE, qos=QoSLevel.EXACTLY_ONCE
         )
         
         # Create test session
@@ -177,25 +261,53 @@ class TestMessageHandler(unittest.TestCase):
             clean_session=True,
             subscriptions={},
             pending_messages={1: qos_msg},
-            timestamp=datetime.now()
+            timestamp=_TS
         )
         
-        # Test retry mechanism
-        await self.message_handler._handle_qos_retry(client_id, qos_msg, publish_packet)
+        # Test retry mechanism with a sleep that only records the backoff
+        delays = []
+        async def record_sleep(delay):
+            delays.append(delay)
+
+        await self.message_handler._handle_qos_retry(
+            client_id, qos_msg, publish_packet, sleep=record_sleep
+        )
         
         # Verify retry attempts
         self.assertEqual(qos_msg.retry_count, self.message_handler.max_retries)
         self.assertFalse(qos_msg.ack_received)
-        mock_sleep.assert_called()
+        self.assertEqual(len(delays), self.message_handler.max_retries)
+
+    async def test_qos_retry_expiry_frees_packet_id(self):
+        """Test an expired retry releases its packet ID after the client left"""
+        # A real allocator, so the freed ID can be observed
+        publish_handler = self.message_handler.publish_handler = PublishHandler()
+        packet_id = publish_handler._get_next_packet_id()
+        qos_msg = QoSMessage(
+            message_id=packet_id,
+            qos_level=QoSLevel.AT_LEAST_ONCE,
+            timestamp=_TS
+        )
+        
+        async def no_sleep(delay):
+            pass
+
+        # No session: the client disconnected before the retries ran out
+        await self.message_handler._handle_qos_retry(
+            "gone_client", qos_msg, _PUBLISH_TEMPLATE, sleep=no_sleep
+        )
+        
+        self.assertTrue(qos_msg.timeout_occurred)
+        self.assertFalse(publish_handler._id_bitmap[packet_id >> 3] & (1 << (packet_id & 7)))
 
-    def test_message_acknowledgment(self):
+    async def test_message_acknowledgment(self):
         """Test handling of message acknowledgments"""
         # Setup test data
         client_id = "test_client"
         qos_msg = QoSMessage(
             message_id=1,
             qos_level=QoSLevel.EXACTLY_ONCE,
-            timestamp=datetime.now()
+            timestamp=_TS
         )
         
         # Create test session with pending message
@@ -204,31 +316,72 @@ class TestMessageHandler(unittest.TestCase):
             clean_session=True,
             subscriptions={},
             pending_messages={1: qos_msg},
-            timestamp=datetime.now()
+            timestamp=_TS
         )
         
-        # Test PUBREC acknowledgment
-        asyncio.run(self.message_handler.handle_message_acknowledgment(
-            client_id, 1, "PUBREC"
-        ))
-        self.assertEqual(qos_msg.state, "PUBREC_RECEIVED")
-        
-        # Test PUBREL acknowledgment
-        asyncio.run(self.message_handler.handle_message_acknowledgment(
-            client_id, 1, "PUBREL"
-        ))
-        self.assertEqual(qos_msg.state, "PUBREL_RECEIVED")
-        
-        # Test PUBCOMP acknowledgment
-        asyncio.run(self.message_handler.handle_message_acknowledgment(
-            client_id, 1, "PUBCOMP"
-        ))
+        # Walk the QoS 2 acknowledgment stages in order
+        expected_states = (
+            ("PUBREC", QoSState.PUBREC_RECEIVED),
+            ("PUBREL", QoSState.PUBREL_RECEIVED),
+            ("PUBCOMP", QoSState.COMPLETED),
+        )
+        for ack_type, expected_state in expected_states:
+            with self.subTest(ack_type=ack_type):
+                await self.message_handler.handle_message_acknowledgment(
+                    client_id, 1, ack_type
+                )
+                self.assertEqual(qos_msg.state, expected_state)
         self.assertTrue(qos_msg.ack_received)
-        self.assertEqual(qos_msg.state, "COMPLETED")
         
         # Verify message removal
         self.assertEqual(len(self.message_handler.sessions[client_id].pending_messages), 0)
 
+    def test_queued_acknowledgment_drain(self):
+        """Test queued acknowledgments are applied before the next publish"""
+        client_id = "test_client"
+        qos_msg = QoSMessage(
+            message_id=1,
+            qos_level=QoSLevel.AT_LEAST_ONCE,
+            timestamp=_TS
+        )
+        self.message_handler.sessions[client_id] = SessionState(
+            client_id=client_id,
+            clean_session=True,
+            subscriptions={},
+            pending_messages={1: qos_msg},
+            timestamp=_TS
+        )
+
+        self.message_handler.enqueue_acknowledgment(client_id, 1, "PUBACK")
+        self.assertIn(1, self.message_handler.sessions[client_id].pending_messages)
+
+        self.message_handler._drain_acknowledgments()
+        self.assertTrue(qos_msg.ack_received)
+        self.assertEqual(len(self.message_handler.sessions[client_id].pending_messages), 0)
+        self.assertTrue(self.message_handler.ack_queue.empty())
+
+    async def test_acknowledgments_applied_in_queue_order(self):
+        """Test a handled acknowledgment first applies the ones queued before it"""
+        client_id = "test_client"
+        messages = {
+            packet_id: QoSMessage(message_id=packet_id, qos_level=QoSLevel.EXACTLY_ONCE, timestamp=_TS)
+            for packet_id in (1, 2)
+        }
+        self.message_handler.sessions[client_id] = SessionState(
+            client_id=client_id,
+            clean_session=True,
+            subscriptions={},
+            pending_messages=dict(messages),
+            timestamp=_TS
+        )
+
+        self.message_handler.enqueue_acknowledgment(client_id, 1, "PUBREC")
+        await self.message_handler.handle_message_acknowledgment(client_id, 2, "PUBCOMP")
+
+        self.assertEqual(messages[1].state, QoSState.PUBREC_RECEIVED)
+        self.assertEqual(messages[2].state, QoSState.COMPLETED)
+        self.assertTrue(self.message_handler.ack_queue.empty())
+
     def test_session_message_retrieval(self):
         """Test retrieving pending messages for a session"""
         # Setup test data
@@ -236,7 +389,7 @@ class TestMessageHandler(unittest.TestCase):
         qos_msg = QoSMessage(
             message_id=1,
             qos_level=QoSLevel.AT_LEAST_ONCE,
-            timestamp=datetime.now()
+            timestamp=_TS
         )
         
         # Create test session
@@ -245,7 +398,7 @@ class TestMessageHandler(unittest.TestCase):
             clean_session=True,
             subscriptions={},
             pending_messages={1: qos_msg},
-            timestamp=datetime.now()
+            timestamp=_TS
         )
         
         # Test message retrieval for existing session
@@ -259,18 +412,4 @@ class TestMessageHandler(unittest.TestCase):
 
 
 if __name__ == '__main__':
-    # Create a test suite combining all test cases
-    suite = unittest.TestSuite()
-
-    suite.addTest(TestMessageQueue("test_retained_message_storage"))
-    suite.addTest(TestMessageQueue("test_inflight_message_tracking"))
-    suite.addTest(TestMessageQueue("test_message_queue_operations"))
-
-    suite.addTest(TestMessageHandler("test_publish_message_routing"))
-    suite.addTest(TestMessageHandler("test_qos_retry_mechanism"))
-    suite.addTest(TestMessageHandler("test_message_acknowledgment"))
-    suite.addTest(TestMessageHandler("test_session_message_retrieval"))
-
-    # Run the test suite
-    runner = unittest.TextTestRunner(verbosity=2)
-    runner.run(suite)
+    unittest.main(verbosity=2)
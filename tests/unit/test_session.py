@@ -1,19 +1,40 @@
+import dataclasses
+import json
 import unittest
-from unittest.mock import Mock, patch
+from unittest.mock import patch
 from datetime import datetime, timedelta
 
-# add src into path, src path upper level two from this file
-import sys
-import os
+from src.session import SessionState, QoSMessage, QoSState, SubscriptionTable
+from src.will_message import QoSLevel
 
-sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+class _FrozenClock:
+    """Stand-in for src.session._now that only moves when shifted"""
+    __slots__ = ('now',)
 
-from src.session import SessionState, QoSMessage
-from src.will_message import QoSLevel
+    def __init__(self, now: datetime):
+        self.now = now
+
+    def __call__(self) -> datetime:
+        return self.now
+
+    def shift(self, delta: timedelta) -> None:
+        self.now += delta
+
+# Prototype cloned for every QoS message the tests need
+_PROTO_MSG = QoSMessage(
+    message_id=0,
+    qos_level=QoSLevel.AT_LEAST_ONCE,
+    timestamp=datetime.now()
+)
 
 class TestSessionStateManagement(unittest.TestCase):
     """Test suite for MQTT session state management"""
 
+    @classmethod
+    def setUpClass(cls):
+        """Share one timestamp across the class"""
+        cls._now = datetime.now()
+
     def setUp(self):
         """Set up test fixtures before each test method"""
         self.client_id = "test_client"
@@ -22,7 +43,7 @@ class TestSessionStateManagement(unittest.TestCase):
             clean_session=True,
             subscriptions={},
             pending_messages={},
-            timestamp=datetime.now()
+            timestamp=self._now
         )
 
     def test_session_creation(self):
@@ -40,7 +61,7 @@ class TestSessionStateManagement(unittest.TestCase):
             clean_session=False,
             subscriptions={"test/topic": QoSLevel.AT_LEAST_ONCE},
             pending_messages={},
-            timestamp=datetime.now()
+            timestamp=self._now
         )
         
         self.assertFalse(persistent_session.clean_session)
@@ -67,13 +88,123 @@ class TestSessionStateManagement(unittest.TestCase):
         self.session_state.subscriptions["test/topic2"] = QoSLevel.AT_LEAST_ONCE
         self.assertEqual(len(self.session_state.subscriptions), 2)
 
+    def test_subscription_removal(self):
+        """Test removing subscriptions keeps the remaining entries intact"""
+        subscriptions = self.session_state.subscriptions
+        self.assertIsInstance(subscriptions, SubscriptionTable)
+        subscriptions["a/topic"] = QoSLevel.AT_MOST_ONCE
+        subscriptions["b/topic"] = QoSLevel.AT_LEAST_ONCE
+        subscriptions["c/topic"] = QoSLevel.EXACTLY_ONCE
+        
+        del subscriptions["a/topic"]
+        self.assertNotIn("a/topic", subscriptions)
+        self.assertEqual(subscriptions, {
+            "b/topic": QoSLevel.AT_LEAST_ONCE,
+            "c/topic": QoSLevel.EXACTLY_ONCE
+        })
+        
+        # Copies are independent of the original table
+        copied = subscriptions.copy()
+        copied["b/topic"] = QoSLevel.AT_MOST_ONCE
+        self.assertEqual(subscriptions["b/topic"], QoSLevel.AT_LEAST_ONCE)
+        
+        with self.assertRaises(KeyError):
+            del subscriptions["a/topic"]
+
+    def test_subscription_copy_on_write(self):
+        """Test copies share storage until either table is written"""
+        original = self.session_state.subscriptions
+        original["a/+"] = QoSLevel.AT_LEAST_ONCE
+        original["b/topic"] = QoSLevel.AT_MOST_ONCE
+        self.assertEqual(original.match("a/x"), QoSLevel.AT_LEAST_ONCE)
+
+        copied = original.copy()
+        self.assertIs(copied._topics, original._topics)
+        self.assertEqual(copied.match("a/x"), QoSLevel.AT_LEAST_ONCE)
+
+        # Writing the copy leaves the original untouched
+        copied["a/+"] = QoSLevel.EXACTLY_ONCE
+        del copied["b/topic"]
+        self.assertEqual(original, {"a/+": QoSLevel.AT_LEAST_ONCE, "b/topic": QoSLevel.AT_MOST_ONCE})
+        self.assertEqual(original.match("a/x"), QoSLevel.AT_LEAST_ONCE)
+        self.assertEqual(copied.match("a/x"), QoSLevel.EXACTLY_ONCE)
+
+        # And writing or clearing the original leaves a fresh copy untouched
+        second = original.copy()
+        original["c/#"] = QoSLevel.AT_MOST_ONCE
+        original.clear()
+        self.assertEqual(second, {"a/+": QoSLevel.AT_LEAST_ONCE, "b/topic": QoSLevel.AT_MOST_ONCE})
+        self.assertIsNone(second.match("c/x"))
+
+    def test_subscription_observer(self):
+        """Test the table reports every change to its observer"""
+        subscriptions = self.session_state.subscriptions
+        changes = []
+        subscriptions.observer = lambda topic, qos: changes.append((topic, qos))
+
+        subscriptions["a/topic"] = QoSLevel.AT_MOST_ONCE
+        subscriptions["a/topic"] = QoSLevel.AT_LEAST_ONCE
+        subscriptions["b/+"] = QoSLevel.EXACTLY_ONCE
+        del subscriptions["a/topic"]
+        subscriptions.clear()
+        self.assertEqual(changes, [
+            ("a/topic", QoSLevel.AT_MOST_ONCE),
+            ("a/topic", QoSLevel.AT_LEAST_ONCE),
+            ("b/+", QoSLevel.EXACTLY_ONCE),
+            ("a/topic", None),
+            ("b/+", None),
+        ])
+
+        # Copies start without an observer
+        self.assertIsNone(subscriptions.copy().observer)
+
+    def test_subscriptions_copied_on_construction(self):
+        """Test a session never aliases the subscriptions it was built from"""
+        sources = {
+            "dict": {"a/topic": QoSLevel.AT_MOST_ONCE},
+            "table": SubscriptionTable({"a/topic": QoSLevel.AT_MOST_ONCE}),
+        }
+        for kind, source in sources.items():
+            with self.subTest(source=kind):
+                session = SessionState(
+                    client_id="copy_test",
+                    clean_session=False,
+                    subscriptions=source,
+                    pending_messages={},
+                    timestamp=self._now
+                )
+                self.assertIsInstance(session.subscriptions, SubscriptionTable)
+                self.assertIsNot(session.subscriptions, source)
+                
+                source["b/topic"] = QoSLevel.AT_LEAST_ONCE
+                self.assertNotIn("b/topic", session.subscriptions)
+                self.assertEqual(session.subscriptions, {"a/topic": QoSLevel.AT_MOST_ONCE})
+
+    def test_subscription_matching(self):
+        """Test matching topic names against wildcard subscriptions"""
+        subscriptions = self.session_state.subscriptions
+        subscriptions["sensors/+/temp"] = QoSLevel.AT_LEAST_ONCE
+        subscriptions["sensors/#"] = QoSLevel.AT_MOST_ONCE
+        subscriptions["sensors/room1/temp"] = QoSLevel.EXACTLY_ONCE
+        
+        # Highest QoS among the matching filters wins
+        self.assertEqual(subscriptions.match("sensors/room1/temp"), QoSLevel.EXACTLY_ONCE)
+        self.assertEqual(subscriptions.match("sensors/room2/temp"), QoSLevel.AT_LEAST_ONCE)
+        self.assertEqual(subscriptions.match("sensors"), QoSLevel.AT_MOST_ONCE)
+        self.assertIsNone(subscriptions.match("other/topic"))
+        
+        # Matching follows later changes to the table
+        del subscriptions["sensors/room1/temp"]
+        self.assertEqual(subscriptions.match("sensors/room1/temp"), QoSLevel.AT_LEAST_ONCE)
+        
+        subscriptions["#"] = QoSLevel.AT_LEAST_ONCE
+        self.assertIsNone(subscriptions.match("$SYS/uptime"))
+
     def test_pending_message_management(self):
         """Test managing pending messages in session state"""
         # Create QoS message
-        qos_message = QoSMessage(
-            message_id=1,
-            qos_level=QoSLevel.AT_LEAST_ONCE,
-            timestamp=datetime.now()
+        qos_message = dataclasses.replace(
+            _PROTO_MSG, message_id=1, timestamp=self._now
         )
         
         # Add pending message
@@ -81,17 +212,16 @@ class TestSessionStateManagement(unittest.TestCase):
         self.assertIn(1, self.session_state.pending_messages)
         
         # Update message state
-        qos_message.state = "PUBREC_RECEIVED"
+        qos_message.state = QoSState.PUBREC_RECEIVED
         self.assertEqual(
             self.session_state.pending_messages[1].state,
-            "PUBREC_RECEIVED"
+            QoSState.PUBREC_RECEIVED
         )
         
         # Multiple pending messages
-        qos_message2 = QoSMessage(
-            message_id=2,
-            qos_level=QoSLevel.EXACTLY_ONCE,
-            timestamp=datetime.now()
+        qos_message2 = dataclasses.replace(
+            _PROTO_MSG, message_id=2, qos_level=QoSLevel.EXACTLY_ONCE,
+            timestamp=self._now
         )
         self.session_state.pending_messages[2] = qos_message2
         self.assertEqual(len(self.session_state.pending_messages), 2)
@@ -99,52 +229,60 @@ class TestSessionStateManagement(unittest.TestCase):
 class TestQoSMessageManagement(unittest.TestCase):
     """Test suite for QoS message handling within sessions"""
 
-    def setUp(self):
-        self.message = QoSMessage(
-            message_id=1,
-            qos_level=QoSLevel.AT_LEAST_ONCE,
-            timestamp=datetime.now()
+    @classmethod
+    def setUpClass(cls):
+        """Build the message template once for the class"""
+        cls._now = datetime.now()
+        cls._template_msg = dataclasses.replace(
+            _PROTO_MSG, message_id=1, timestamp=cls._now
         )
 
+    def setUp(self):
+        self.message = dataclasses.replace(self._template_msg)
+
     def test_qos_message_creation(self):
         """Test creating new QoS message"""
         self.assertEqual(self.message.message_id, 1)
         self.assertEqual(self.message.qos_level, QoSLevel.AT_LEAST_ONCE)
         self.assertEqual(self.message.retry_count, 0)
-        self.assertEqual(self.message.state, "PENDING")
+        self.assertEqual(self.message.state, QoSState.PENDING)
         self.assertFalse(self.message.ack_received)
 
     def test_qos_message_state_transitions(self):
         """Test QoS message state transitions"""
         # Initial state
-        self.assertEqual(self.message.state, "PENDING")
+        self.assertEqual(self.message.state, QoSState.PENDING)
         
         # Test complete QoS2 flow
         expected_states = [
-            "PENDING",
-            "PUBREC_RECEIVED",
-            "PUBREL_SENT",
-            "PUBCOMP_RECEIVED"
+            QoSState.PENDING,
+            QoSState.PUBREC_RECEIVED,
+            QoSState.PUBREL_SENT,
+            QoSState.PUBCOMP_RECEIVED
         ]
         
         for state in expected_states:
-            self.message.state = state
-            self.assertEqual(self.message.state, state)
-        
-        # Test acknowledgment
+            with self.subTest(state=state):
+                self.message.state = state
+                self.assertEqual(self.message.state, state)
+
+    def test_qos_message_acknowledgment(self):
+        """Test marking a QoS message as acknowledged"""
         self.message.ack_received = True
         self.assertTrue(self.message.ack_received)
-        
-        # Test timeout status
+
+    def test_qos_message_timeout(self):
+        """Test flagging a QoS message timeout"""
         self.message.timeout_occurred = True
         self.assertTrue(self.message.timeout_occurred)
-        
-        # Test message expiry
-        original_timestamp = self.message.timestamp
-        self.message.timestamp = datetime.now() - timedelta(hours=2)
-        self.assertTrue(
-            (datetime.now() - self.message.timestamp) > timedelta(hours=1)
-        )
+
+    def test_qos_message_expiry(self):
+        """Test QoS message expiry against the session clock"""
+        clock = _FrozenClock(self._now)
+        with patch("src.session._now", clock):
+            clock.shift(timedelta(hours=2))
+            self.assertTrue(self.message.is_expired(timedelta(hours=1)))
+            self.assertFalse(self.message.is_expired(timedelta(hours=3)))
 
     def test_qos_message_retry_tracking(self):
         """Test tracking message retry attempts"""
@@ -161,13 +299,18 @@ class TestQoSMessageManagement(unittest.TestCase):
 class TestSessionStateOperations(unittest.TestCase):
     """Test suite for session state operations"""
 
+    @classmethod
+    def setUpClass(cls):
+        """Share one timestamp across the class"""
+        cls._now = datetime.now()
+
     def setUp(self):
         self.session_state = SessionState(
             client_id="test_client",
             clean_session=False,
             subscriptions={},
             pending_messages={},
-            timestamp=datetime.now()
+            timestamp=self._now
         )
         
     def test_session_restoration(self):
@@ -178,13 +321,11 @@ class TestSessionStateOperations(unittest.TestCase):
             clean_session=False,
             subscriptions={"test/topic": QoSLevel.AT_LEAST_ONCE},
             pending_messages={
-                1: QoSMessage(
-                    message_id=1,
-                    qos_level=QoSLevel.AT_LEAST_ONCE,
-                    timestamp=datetime.now()
+                1: dataclasses.replace(
+                    _PROTO_MSG, message_id=1, timestamp=self._now
                 )
             },
-            timestamp=datetime.now()
+            timestamp=self._now
         )
         
         # Simulate session restoration
@@ -193,7 +334,7 @@ class TestSessionStateOperations(unittest.TestCase):
             clean_session=False,
             subscriptions=original_session.subscriptions.copy(),
             pending_messages=original_session.pending_messages.copy(),
-            timestamp=datetime.now()
+            timestamp=self._now
         )
         
         # Verify restored session state
@@ -204,46 +345,63 @@ class TestSessionStateOperations(unittest.TestCase):
             len(original_session.pending_messages)
         )
         self.assertFalse(restored_session.clean_session)
+        
+        # The restored table still answers wildcard-aware lookups
+        self.assertIsInstance(restored_session.subscriptions, SubscriptionTable)
+        self.assertEqual(
+            restored_session.subscriptions.match("test/topic"), QoSLevel.AT_LEAST_ONCE
+        )
+        
+        # Writes to the restored session leave the original untouched
+        restored_session.subscriptions["other/topic"] = QoSLevel.EXACTLY_ONCE
+        del restored_session.pending_messages[1]
+        self.assertNotIn("other/topic", original_session.subscriptions)
+        self.assertIn(1, original_session.pending_messages)
+        
+        # ...and later changes to the original do not leak into the restored one
+        original_session.subscriptions["late/topic"] = QoSLevel.AT_MOST_ONCE
+        del original_session.subscriptions["test/topic"]
+        self.assertNotIn("late/topic", restored_session.subscriptions)
+        self.assertIn("test/topic", restored_session.subscriptions)
+        self.assertIsNone(restored_session.subscriptions.match("late/topic"))
 
     def test_session_expiry(self):
         """Test session expiry determination"""
-        # Create session with old timestamp
+        # Create session, then advance the clock past its expiry
         old_session = SessionState(
             client_id="old_client",
             clean_session=False,
             subscriptions={},
             pending_messages={},
-            timestamp=datetime.now() - timedelta(hours=2)
+            timestamp=self._now
         )
-        
-        # Session should be considered expired
         session_expiry = timedelta(hours=1)
-        self.assertTrue(
-            (datetime.now() - old_session.timestamp) > session_expiry
-        )
+        
+        clock = _FrozenClock(self._now)
+        with patch("src.session._now", clock):
+            clock.shift(timedelta(minutes=30))
+            self.assertFalse(old_session.is_expired(session_expiry))
+            # Session should be considered expired
+            clock.shift(timedelta(minutes=90))
+            self.assertTrue(old_session.is_expired(session_expiry))
 
     def test_session_cleanup(self):
         """Test cleaning up session state"""
         # Add some test data
         self.session_state.subscriptions["test/topic"] = QoSLevel.AT_LEAST_ONCE
-        self.session_state.pending_messages[1] = QoSMessage(
-            message_id=1,
-            qos_level=QoSLevel.AT_LEAST_ONCE,
-            timestamp=datetime.now()
+        self.session_state.pending_messages[1] = dataclasses.replace(
+            _PROTO_MSG, message_id=1, timestamp=self._now
         )
         
         # Add expired message
-        self.session_state.pending_messages[2] = QoSMessage(
-            message_id=2,
-            qos_level=QoSLevel.EXACTLY_ONCE,
-            timestamp=datetime.now() - timedelta(hours=2)
+        self.session_state.pending_messages[2] = dataclasses.replace(
+            _PROTO_MSG, message_id=2, qos_level=QoSLevel.EXACTLY_ONCE,
+            timestamp=self._now - timedelta(hours=2)
         )
         
         # Add completed message
-        completed_message = QoSMessage(
-            message_id=3,
-            qos_level=QoSLevel.AT_LEAST_ONCE,
-            timestamp=datetime.now()
+        completed_message = dataclasses.replace(
+            _PROTO_MSG, message_id=3, timestamp=self._now
         )
         completed_message.ack_received = True
         self.session_state.pending_messages[3] = completed_message
@@ -252,24 +410,12 @@ class TestSessionStateOperations(unittest.TestCase):
         self.assertEqual(len(self.session_state.subscriptions), 1)
         self.assertEqual(len(self.session_state.pending_messages), 3)
         
-        # Clean expired messages
-        expired_messages = [
-            msg_id for msg_id, msg in self.session_state.pending_messages.items()
-            if (datetime.now() - msg.timestamp) > timedelta(hours=1)
-        ]
-        for msg_id in expired_messages:
-            del self.session_state.pending_messages[msg_id]
-        
-        # Clean completed messages
-        completed_messages = [
-            msg_id for msg_id, msg in self.session_state.pending_messages.items()
-            if msg.ack_received
-        ]
-        for msg_id in completed_messages:
-            del self.session_state.pending_messages[msg_id]
+        # Clean expired and completed messages
+        with patch("src.session._now", _FrozenClock(self._now)):
+            self.session_state.cleanup_pending_messages(timedelta(hours=1))
         
         # Verify cleanup of expired and completed messages
-        self.assertEqual(len(self.session_state.pending_messages), 1)
+        self.assertEqual(list(self.session_state.pending_messages), [1])
         
         # Clear entire session
         self.session_state.subscriptions.clear()
@@ -283,20 +429,13 @@ class TestSessionStateOperations(unittest.TestCase):
         """Test session data persistence operations"""
         # Add test data
         self.session_state.subscriptions["test/topic"] = QoSLevel.AT_LEAST_ONCE
-        qos_message = QoSMessage(
-            message_id=1,
-            qos_level=QoSLevel.AT_LEAST_ONCE,
-            timestamp=datetime.now()
+        qos_message = dataclasses.replace(
+            _PROTO_MSG, message_id=1, timestamp=self._now
         )
         self.session_state.pending_messages[1] = qos_message
         
         # Verify data persistence
-        serialized_data = {
-            'client_id': self.session_state.client_id,
-            'clean_session': self.session_state.clean_session,
-            'subscriptions': self.session_state.subscriptions,
-            'timestamp': self.session_state.timestamp.isoformat()
-        }
+        serialized_data = json.loads(self.session_state.to_json())
         
         # Verify all required data is present
         self.assertIn('client_id', serialized_data)
@@ -307,27 +446,29 @@ class TestSessionStateOperations(unittest.TestCase):
         # Verify data integrity
         self.assertEqual(serialized_data['client_id'], "test_client")
         self.assertFalse(serialized_data['clean_session'])
-        self.assertIn("test/topic", serialized_data['subscriptions'])
+        self.assertEqual(serialized_data['subscriptions'], {"test/topic": 1})
+        self.assertIs(type(serialized_data['subscriptions']["test/topic"]), int)
+        self.assertEqual(
+            datetime.fromisoformat(serialized_data['timestamp']),
+            self.session_state.timestamp
+        )
+
+    def test_session_json_without_orjson(self):
+        """Test the standard library fallback emits the same UTF-8 JSON"""
+        session = SessionState(
+            client_id="capteur_\u00e9",
+            clean_session=False,
+            subscriptions={"maison/caf\u00e9": QoSLevel.AT_LEAST_ONCE},
+            pending_messages={},
+            timestamp=self._now
+        )
+        encoded = session.to_json()
+        with patch('src.session.orjson', None):
+            fallback = session.to_json()
+        
+        self.assertIn("maison/caf\u00e9".encode('utf-8'), fallback)
+        self.assertNotIn(b"\\u", fallback)
+        self.assertEqual(fallback, encoded)
 
 if __name__ == '__main__':
-    """Run session test suites"""
-    suite = unittest.TestSuite()
-    
-    # Add test classes to suite
-    suite.addTest(TestSessionStateManagement("test_session_creation"))
-    suite.addTest(TestSessionStateManagement("test_persistent_session_creation"))
-    suite.addTest(TestSessionStateManagement("test_subscription_management"))
-    suite.addTest(TestSessionStateManagement("test_pending_message_management"))
-
-    suite.addTest(TestQoSMessageManagement("test_qos_message_creation"))
-    suite.addTest(TestQoSMessageManagement("test_qos_message_state_transitions"))
-    suite.addTest(TestQoSMessageManagement("test_qos_message_retry_tracking"))
-    
-    suite.addTest(TestSessionStateOperations("test_session_restoration"))
-    suite.addTest(TestSessionStateOperations("test_session_expiry"))
-    suite.addTest(TestSessionStateOperations("test_session_cleanup"))
-    suite.addTest(TestSessionStateOperations("test_session_data_persistence"))
-
-    # Run the test suite
-    runner = unittest.TextTestRunner(verbosity=2)
-    runner.run(suite)
\ No newline at end of file
+    unittest.main(verbosity=2)
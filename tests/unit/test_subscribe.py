@@ -1,19 +1,14 @@
 import unittest
 import asyncio
-from unittest.mock import Mock, patch
+from unittest.mock import Mock
 from datetime import datetime
 
-# add src into path, src path upper level two from this file
-import sys
-import os
-
-sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
-
 from src.subscribe import (
     SubscribePacket,
     SubscriptionHandler,
-    TopicNode,
+    TopicPath,
     MessageType,
+    validate_topic_filter,
     QoSLevel,
     SessionState
 )
@@ -42,13 +37,34 @@ class TestInternalTopicMatching(unittest.TestCase):
         # Verify that client1 is in the subscribers set
         self.assertIn("client1", node.subscribers)
 
-class TestPublicTopicMatching(unittest.TestCase):
+    def test_internal_level_mask(self):
+        """Test that wildcard paths record the depths where their filters end"""
+        handler = self.subscription_handler
+        handler._add_topic_node(["a", "+", "c"], "client1", QoSLevel.AT_MOST_ONCE)
+        handler._add_topic_node(["a", "b"], "client1", QoSLevel.AT_MOST_ONCE)
+        handler.sessions = {"client1": Mock()}
+        
+        node_a = handler.topic_tree.children["a"]
+        self.assertEqual(node_a.level_mask, 1 << 2)
+        self.assertEqual(node_a.children["b"].level_mask, 0)  # Exact filters only
+        self.assertFalse(node_a.has_hash)
+        
+        self.assertIn("client1", handler.get_matching_subscribers("a/x/c"))
+        self.assertNotIn("client1", handler.get_matching_subscribers("a/x/c/d"))
+        self.assertNotIn("client1", handler.get_matching_subscribers("a/x"))
+        
+        handler._add_topic_node(["a", "#"], "client2", QoSLevel.AT_LEAST_ONCE)
+        handler.sessions["client2"] = Mock()
+        self.assertTrue(node_a.has_hash)
+        self.assertIn("client2", handler.get_matching_subscribers("a/x/c/d"))
+
+# Async suites keep the stock loop per test: sharing one loop needs unittest's
+# private runner hooks and lets tasks left pending by one test leak into the next
+class TestPublicTopicMatching(unittest.IsolatedAsyncioTestCase):
     """Test suite for public topic matching API"""
     
     def setUp(self):
-        self.subscription_handler = SubscriptionHandler()
-
-        # Create mock sessions with subscriptions
+        """Build a subscribed handler for each test"""
         self.client1_subscriptions = {
             "home/livingroom/temp": QoSLevel.AT_LEAST_ONCE,
             "home/+/temp": QoSLevel.AT_MOST_ONCE,
@@ -60,6 +76,8 @@ class TestPublicTopicMatching(unittest.TestCase):
             "home/livingroom/#": QoSLevel.AT_MOST_ONCE
         }
 
+        self.subscription_handler = SubscriptionHandler()
+
         # Create mock sessions
         self.subscription_handler.sessions = {
             "client1": Mock(subscriptions=self.client1_subscriptions),
@@ -68,27 +86,19 @@ class TestPublicTopicMatching(unittest.TestCase):
 
         # Add subscriptions to the topic tree
         for topic, qos in self.client1_subscriptions.items():
-            topic_parts = topic.split("/")
-            if "#" in topic_parts:
-                # For multi-level wildcards, only include parts up to #
-                idx = topic_parts.index("#")
-                topic_parts = topic_parts[:idx+1]
-            self.subscription_handler._add_topic_node(topic_parts, "client1", qos)
+            self.subscription_handler._add_topic_node(TopicPath.parse(topic), "client1", qos)
         
         for topic, qos in self.client2_subscriptions.items():
-            topic_parts = topic.split("/")
-            if "#" in topic_parts:
-                idx = topic_parts.index("#")
-                topic_parts = topic_parts[:idx+1]
-            self.subscription_handler._add_topic_node(topic_parts, "client2", qos)
+            self.subscription_handler._add_topic_node(TopicPath.parse(topic), "client2", qos)
 
     async def test_exact_topic_match(self):
         # Test exact topic matching
         matches = self.subscription_handler.get_matching_subscribers("home/livingroom/temp")
         self.assertIn("client1", matches)
-        self.assertEqual(matches["client1"], QoSLevel.AT_LEAST_ONCE)
+        # Overlapping "home/#" grants the highest QoS
+        self.assertEqual(matches["client1"], QoSLevel.EXACTLY_ONCE)
         
-        # Verify non-matching topic returns empty result
+        # Other rooms still match through the wildcard filters
         non_matches = self.subscription_handler.get_matching_subscribers("home/kitchen/temp")
         self.assertIn("client1", non_matches)
 
@@ -125,6 +135,11 @@ class TestPublicTopicMatching(unittest.TestCase):
 class TestPublicSubscriptionManagement(unittest.IsolatedAsyncioTestCase):
     """Test suite for public subscription management API with real packet handling"""
     
+    @classmethod
+    def setUpClass(cls):
+        """Share one timestamp across the class"""
+        cls._now = datetime.now()
+
     async def asyncSetUp(self):
         """Set up test environment before each test"""
         self.subscription_handler = SubscriptionHandler()
@@ -136,7 +151,7 @@ class TestPublicSubscriptionManagement(unittest.IsolatedAsyncioTestCase):
             clean_session=True,
             subscriptions={},
             pending_messages={},
-            timestamp=datetime.now()
+            timestamp=self._now
         )
         self.subscription_handler.sessions[self.client_id] = self.session
 
@@ -193,6 +208,16 @@ class TestPublicSubscriptionManagement(unittest.IsolatedAsyncioTestCase):
         for topic in test_topics:
             matches = self.subscription_handler.get_matching_subscribers(topic)
             self.assertIn(self.client_id, matches)
+        
+        # A batch lookup returns the same matches, one result per topic
+        batch = self.subscription_handler.get_matching_subscribers_batch(
+            test_topics + ["unmatched/topic"]
+        )
+        self.assertEqual(
+            batch[:-1],
+            [self.subscription_handler.get_matching_subscribers(t) for t in test_topics]
+        )
+        self.assertEqual(batch[-1], {})
 
     async def test_duplicate_subscription_handling(self):
         """Test handling of duplicate subscriptions with different QoS levels"""
@@ -208,6 +233,8 @@ class TestPublicSubscriptionManagement(unittest.IsolatedAsyncioTestCase):
         
         # Verify first subscription
         self.assertEqual(self.session.subscriptions[topic], QoSLevel.AT_MOST_ONCE)
+        matches = self.subscription_handler.get_matching_subscribers(topic)
+        self.assertEqual(matches[self.client_id], QoSLevel.AT_MOST_ONCE)
         
         # Second subscription with higher QoS
         packet2 = SubscribePacket(
@@ -262,9 +289,92 @@ class TestPublicSubscriptionManagement(unittest.IsolatedAsyncioTestCase):
         del self.subscription_handler.sessions[self.client_id]
         
         # Verify subscriptions were removed
+        test_node = self.subscription_handler.topic_tree.children["test"]
         for topic, _ in subscriptions:
             matches = self.subscription_handler.get_matching_subscribers(topic)
             self.assertNotIn(self.client_id, matches)
+            self.assertNotIn(self.client_id, test_node.children[topic.split("/")[1]].subscribers)
+
+    async def test_remove_session(self):
+        """Test removing a session drops only that client's subscriptions"""
+        other_id = "other_client"
+        self.subscription_handler.sessions[other_id] = self.session
+        packet = SubscribePacket(
+            packet_id=1,
+            topic_filters=[("test/topic", QoSLevel.AT_LEAST_ONCE), ("test/#", QoSLevel.AT_MOST_ONCE)]
+        )
+        await self.subscription_handler.handle_subscribe(self.client_id, packet)
+        await self.subscription_handler.handle_subscribe(other_id, packet)
+        self.assertEqual(
+            set(self.subscription_handler.get_matching_subscribers("test/topic")),
+            {self.client_id, other_id}
+        )
+        
+        self.subscription_handler.remove_session(self.client_id)
+        
+        self.assertNotIn(self.client_id, self.subscription_handler.sessions)
+        self.assertEqual(
+            self.subscription_handler.get_matching_subscribers("test/topic"),
+            {other_id: QoSLevel.AT_LEAST_ONCE}
+        )
+        hash_node = self.subscription_handler.topic_tree.children["test"].children["#"]
+        self.assertEqual(list(hash_node.subscribers), [other_id])
+
+    async def test_session_changes_update_matching(self):
+        """Test replacing, editing or reassigning sessions keeps matching in step"""
+        packet = SubscribePacket(packet_id=1, topic_filters=[("test/#", QoSLevel.AT_LEAST_ONCE)])
+        await self.subscription_handler.handle_subscribe(self.client_id, packet)
+        self.assertIn(self.client_id, self.subscription_handler.get_matching_subscribers("test/a"))
+        
+        # Repeat lookups are served from the cache with the final result
+        self.assertIs(
+            self.subscription_handler.get_matching_subscribers("test/a"),
+            self.subscription_handler.get_matching_subscribers("test/a")
+        )
+        
+        # Edits to the session's own table update the tree directly
+        self.session.subscriptions["test/#"] = QoSLevel.EXACTLY_ONCE
+        self.assertEqual(
+            self.subscription_handler.get_matching_subscribers("test/a"),
+            {self.client_id: QoSLevel.EXACTLY_ONCE}
+        )
+        del self.session.subscriptions["test/#"]
+        self.assertEqual(self.subscription_handler.get_matching_subscribers("test/a"), {})
+        self.assertNotIn(self.client_id, self.subscription_handler._by_client)
+        
+        # Replacing the session with a clean one drops the old filters
+        await self.subscription_handler.handle_subscribe(self.client_id, packet)
+        self.subscription_handler.sessions[self.client_id] = SessionState(
+            client_id=self.client_id,
+            clean_session=True,
+            subscriptions={},
+            pending_messages={},
+            timestamp=self._now
+        )
+        self.assertEqual(self.subscription_handler.get_matching_subscribers("test/a"), {})
+        
+        # The replaced session's table no longer feeds the tree
+        self.session.subscriptions["test/+"] = QoSLevel.AT_MOST_ONCE
+        self.assertEqual(self.subscription_handler.get_matching_subscribers("test/a"), {})
+        
+        # A session inserted with subscriptions is matched straight away
+        restored = SessionState(
+            client_id=self.client_id,
+            clean_session=False,
+            subscriptions={"test/+": QoSLevel.EXACTLY_ONCE},
+            pending_messages={},
+            timestamp=self._now
+        )
+        self.subscription_handler.sessions = {self.client_id: restored}
+        self.assertEqual(
+            self.subscription_handler.get_matching_subscribers("test/a"),
+            {self.client_id: QoSLevel.EXACTLY_ONCE}
+        )
+        
+        # Sessions assigned as a plain dict still clean up on removal
+        del self.subscription_handler.sessions[self.client_id]
+        self.assertNotIn(self.client_id, self.subscription_handler._by_client)
+        self.assertEqual(self.subscription_handler.get_matching_subscribers("test/a"), {})
 
     async def test_wildcard_subscription_matching(self):
         """Test wildcard subscription matching patterns"""
@@ -301,6 +411,60 @@ class TestPublicSubscriptionManagement(unittest.IsolatedAsyncioTestCase):
             self.assertIn(self.client_id, matches)
             self.assertEqual(matches[self.client_id], QoSLevel.AT_LEAST_ONCE)
 
+    async def test_prefix_sharing_subscription_batch(self):
+        """Test one SUBSCRIBE with filters sharing prefixes, in any order"""
+        subscriptions = [
+            ("home/kitchen/temp", QoSLevel.AT_LEAST_ONCE),
+            ("home/+", QoSLevel.AT_MOST_ONCE),
+            ("home/kitchen", QoSLevel.EXACTLY_ONCE),
+            ("home/kitchen/temp", QoSLevel.EXACTLY_ONCE)  # Repeated filter wins
+        ]
+        packet = SubscribePacket(packet_id=1, topic_filters=subscriptions)
+        return_codes = await self.subscription_handler.handle_subscribe(self.client_id, packet)
+        self.assertEqual(return_codes, [qos for _, qos in subscriptions])
+        
+        home = self.subscription_handler.topic_tree.children["home"]
+        self.assertEqual(set(home.children), {"kitchen", "+"})
+        self.assertEqual(
+            home.children["kitchen"].children["temp"].subscribers[self.client_id],
+            QoSLevel.EXACTLY_ONCE
+        )
+        
+        expected = {
+            "home/kitchen/temp": QoSLevel.EXACTLY_ONCE,
+            "home/kitchen": QoSLevel.EXACTLY_ONCE,
+            "home/garage": QoSLevel.AT_MOST_ONCE
+        }
+        for topic, qos in expected.items():
+            with self.subTest(topic=topic):
+                matches = self.subscription_handler.get_matching_subscribers(topic)
+                self.assertEqual(matches, {self.client_id: qos})
+
+    async def test_overlapping_subscription_matching(self):
+        """Test that overlapping filters yield the highest granted QoS"""
+        subscriptions = [
+            ("sensors/+/temp", QoSLevel.AT_LEAST_ONCE),
+            ("sensors/#", QoSLevel.AT_MOST_ONCE),
+            ("sensors/room1/temp", QoSLevel.EXACTLY_ONCE),
+            ("#", QoSLevel.AT_MOST_ONCE)
+        ]
+        packet = SubscribePacket(packet_id=1, topic_filters=subscriptions)
+        await self.subscription_handler.handle_subscribe(self.client_id, packet)
+        
+        expected = {
+            "sensors/room1/temp": QoSLevel.EXACTLY_ONCE,
+            "sensors/room2/temp": QoSLevel.AT_LEAST_ONCE,
+            "sensors": QoSLevel.AT_MOST_ONCE,  # '#' also matches the parent level
+            "other/topic": QoSLevel.AT_MOST_ONCE
+        }
+        for topic, qos in expected.items():
+            with self.subTest(topic=topic):
+                matches = self.subscription_handler.get_matching_subscribers(topic)
+                self.assertEqual(matches, {self.client_id: qos})
+        
+        # Wildcards at the first level never match '$' topics
+        self.assertEqual(self.subscription_handler.get_matching_subscribers("$SYS/uptime"), {})
+
 class TestSubscribePacketHandling(unittest.IsolatedAsyncioTestCase):
     """Test suite for SUBSCRIBE packet handling"""
     
@@ -322,6 +486,24 @@ class TestSubscribePacketHandling(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(encoded[0] & 0x02, 0x02)  # QoS 1 required
         self.assertEqual(int.from_bytes(encoded[2:4], 'big'), 1)  # Packet ID
 
+    def test_subscribe_packet_payload_encoding(self):
+        """Test SUBSCRIBE payload layout with multiple and non-ASCII filters"""
+        packet = SubscribePacket(
+            packet_id=0x1234,
+            topic_filters=[
+                ("a/b", QoSLevel.AT_MOST_ONCE),
+                ("température/+", QoSLevel.EXACTLY_ONCE)
+            ]
+        )
+        
+        topic2 = "température/+".encode()
+        expected_body = (
+            b"\x12\x34"
+            + b"\x00\x03a/b\x00"
+            + len(topic2).to_bytes(2, 'big') + topic2 + b"\x02"
+        )
+        self.assertEqual(packet.encode(), bytes([0x82, len(expected_body)]) + expected_body)
+
     async def test_handle_subscribe_packet(self):
         """Test handling of SUBSCRIBE packet"""
         packet = SubscribePacket(
@@ -382,6 +564,24 @@ class TestSubscribePacketHandling(unittest.IsolatedAsyncioTestCase):
         self.assertIn("client1", leaf_node.subscribers)
         self.assertEqual(leaf_node.subscribers["client1"], QoSLevel.AT_MOST_ONCE)
 
+    def test_topic_filter_validation(self):
+        """Test topic filter validation rules"""
+        cases = {
+            "a/b": True,
+            "+": True,
+            "#": True,
+            "+/+/c": True,
+            "a/+/#": True,
+            "/a": False,
+            "a/": False,
+            "a/b#": False,
+            "a+/b": False,
+            "a/#/b": False
+        }
+        for topic, valid in cases.items():
+            with self.subTest(topic=topic):
+                self.assertEqual(validate_topic_filter(topic), valid)
+
     async def test_handle_invalid_topic_filter(self):
         """Test handling of invalid topic filters"""
         packet = SubscribePacket(
@@ -404,7 +604,7 @@ class TestSubscribePacketHandling(unittest.IsolatedAsyncioTestCase):
     async def test_suback_generation(self):
         """Test SUBACK packet generation"""
         mock_writer = Mock(spec=asyncio.StreamWriter)
-        return_codes = [QoSLevel.AT_MOST_ONCE, QoSLevel.AT_LEAST_ONCE]
+        return_codes = [QoSLevel.AT_MOST_ONCE, QoSLevel.AT_LEAST_ONCE, 0x80]
         
         await self.subscription_handler.send_suback(mock_writer, 1, return_codes)
         
@@ -414,33 +614,9 @@ class TestSubscribePacketHandling(unittest.IsolatedAsyncioTestCase):
         
         # Verify SUBACK packet structure
         self.assertEqual(written_data[0] >> 4, MessageType.SUBACK)
+        self.assertEqual(written_data[1], 2 + len(return_codes))  # Remaining length
         self.assertEqual(int.from_bytes(written_data[2:4], 'big'), 1)  # Packet ID
         self.assertEqual(list(written_data[4:]), return_codes)  # Return codes
 
-if __name__ == "__main__":
-    """Run subscription test suites"""
-    suite = unittest.TestSuite()
-    
-    # # Add test classes to suite
-    suite.addTest(TestInternalTopicMatching("test_internal_add_topic_node"))
-
-    suite.addTest(TestPublicTopicMatching("test_exact_topic_match"))
-    suite.addTest(TestPublicTopicMatching("test_single_level_wildcard_match"))
-    suite.addTest(TestPublicTopicMatching("test_multi_level_wildcard_match"))
-    suite.addTest(TestPublicTopicMatching("test_nested_topic_structure"))
-
-    suite.addTest(TestPublicSubscriptionManagement("test_basic_subscription_handling"))
-    suite.addTest(TestPublicSubscriptionManagement("test_multiple_topic_subscription"))
-    suite.addTest(TestPublicSubscriptionManagement("test_duplicate_subscription_handling"))
-    suite.addTest(TestPublicSubscriptionManagement("test_invalid_subscription_handling"))
-    suite.addTest(TestPublicSubscriptionManagement("test_subscription_cleanup"))
-    suite.addTest(TestPublicSubscriptionManagement("test_wildcard_subscription_matching"))
-
-    suite.addTest(TestSubscribePacketHandling("test_subscribe_packet_encoding"))
-    suite.addTest(TestSubscribePacketHandling("test_handle_subscribe_packet"))
-    suite.addTest(TestSubscribePacketHandling("test_suback_generation"))
-
-    # Run tests
-    runner = unittest.TextTestRunner(verbosity=2)
-    runner.run(suite).wasSuccessful()
-
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -1,41 +1,63 @@
 import unittest
 import asyncio
-from datetime import timedelta, datetime
-from unittest.mock import Mock, patch, AsyncMock, call
+from dataclasses import FrozenInstanceError
+from datetime import datetime
+from types import SimpleNamespace
 
-# add src into path, src path upper level two from this file
-import sys
-import os
-
-sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+import pytest
 
 from src.will_message import WillMessage, QoSLevel
 from src.session import SessionState
-from src.connection import (
-    ConnectionHandler,
-    ConnectPacket,
-    MessageType,
-    FixedHeader,
-    ConnectFlags
+from src.connection import ConnectionHandler
+
+# Shared immutable inputs
+_MAX_DELAY = 2**32 - 1  # Largest will delay interval (uint32)
+_TEST_PAYLOAD = b"test"
+_WILL_TOPIC = "test/will"
+_UTF8_MSG = "测试消息".encode('utf-8')
+_FIXED_TS = datetime(2024, 1, 1)  # Session timestamps are never asserted on
+
+# (field overrides, expected exception) for rejected will messages
+_INVALID_WILL_CASES = (
+    ({"qos": 99}, ValueError),                  # QoS level too high
+    ({"qos": -1}, ValueError),                  # Negative QoS level
+    ({"payload": "string payload"}, TypeError), # Payload should be bytes
+    ({"delay_interval": "30"}, TypeError),      # Delay should be int
+    ({"delay_interval": -1}, ValueError),       # Negative delay
 )
 
+class _FakeWriter:
+    """StreamWriter stand-in counting close() and wait_closed() calls"""
+    __slots__ = ('closed', 'waited')
+
+    def __init__(self):
+        self.closed = 0
+        self.waited = 0
+
+    def close(self):
+        self.closed += 1
+
+    async def wait_closed(self):
+        self.waited += 1
+
 class TestWillMessageSetup(unittest.TestCase):
     """Test suite for MQTT will message setup and properties"""
     
-    def setUp(self):
-        """Set up test fixtures before each test method"""
-        self.topic = "test/will"
-        self.payload = b"client disconnected"
-        self.qos = QoSLevel.AT_LEAST_ONCE
-        self.retain = True
-        self.delay_interval = 30
-        
-        self.will_message = WillMessage(
-            topic=self.topic,
-            payload=self.payload,
-            qos=self.qos,
-            retain=self.retain,
-            delay_interval=self.delay_interval
+    @classmethod
+    def setUpClass(cls):
+        """Build the read-only will message shared by every test method"""
+        cls.topic = _WILL_TOPIC
+        cls.payload = b"client disconnected"
+        cls.qos = QoSLevel.AT_LEAST_ONCE
+        cls.retain = True
+        cls.delay_interval = 30
+        
+        cls.will_message = WillMessage(
+            topic=cls.topic,
+            payload=cls.payload,
+            qos=cls.qos,
+            retain=cls.retain,
+            delay_interval=cls.delay_interval
         )
 
     def test_will_message_creation(self):
@@ -61,24 +83,16 @@ class TestWillMessageSetup(unittest.TestCase):
 
     def test_will_message_payload_types(self):
         """Test will message with different payload types"""
-        # Test with empty payload
-        empty_will = WillMessage(
-            topic="test/empty",
-            payload=b"",
-            qos=QoSLevel.AT_MOST_ONCE,
-            retain=False
-        )
-        self.assertEqual(empty_will.payload, b"")
-        
-        # Test with UTF-8 encoded payload
-        utf8_payload = "测试消息".encode('utf-8')
-        utf8_will = WillMessage(
-            topic="test/utf8",
-            payload=utf8_payload,
-            qos=QoSLevel.AT_MOST_ONCE,
-            retain=False
-        )
-        self.assertEqual(utf8_will.payload, utf8_payload)
+        # Empty, UTF-8 encoded and larger binary payloads
+        for payload in [b"", _UTF8_MSG, b"x" * 1024]:
+            with self.subTest(payload=payload[:16]):
+                will = WillMessage(
+                    topic="test/payload",
+                    payload=payload,
+                    qos=QoSLevel.AT_MOST_ONCE,
+                    retain=False
+                )
+                self.assertEqual(will.payload, payload)
 
     def test_qos_level_validation(self):
         """Test QoS level enumeration values"""
@@ -86,15 +100,13 @@ class TestWillMessageSetup(unittest.TestCase):
         self.assertEqual(QoSLevel.AT_LEAST_ONCE.value, 1)
         self.assertEqual(QoSLevel.EXACTLY_ONCE.value, 2)
         
-        # Test all valid QoS levels
-        for qos in QoSLevel:
-            will = WillMessage(
-                topic="test/qos",
-                payload=b"test",
-                qos=qos,
-                retain=False
-            )
-            self.assertIsInstance(will.qos, QoSLevel)
+        # Test all valid QoS levels, plain ints included
+        base = dict(topic="test/qos", payload=_TEST_PAYLOAD, retain=False)
+        for qos in [*QoSLevel, 0, 1, 2]:
+            with self.subTest(qos=qos):
+                will = WillMessage(qos=qos, **base)
+                self.assertIsInstance(will.qos, QoSLevel)
+                self.assertEqual(will.qos, qos)
             
     def test_will_message_verify_content(self):
         """Test will message content verification"""
@@ -123,120 +135,78 @@ class TestWillMessageSetup(unittest.TestCase):
 class TestWillMessageBehavior(unittest.TestCase):
     """Test suite for will message behavior and triggers"""
 
-    def setUp(self):
-        self.will_message = WillMessage(
-            topic="test/will",
+    @classmethod
+    def setUpClass(cls):
+        """Build the read-only will message shared by every test method"""
+        cls.will_message = WillMessage(
+            topic=_WILL_TOPIC,
             payload=b"disconnected",
             qos=QoSLevel.EXACTLY_ONCE,
             retain=True,
             delay_interval=60
         )
 
-    # def test_will_message_immutability(self):
-    #     """Test that will message properties cannot be modified after creation"""
-    #     with self.assertRaises(AttributeError):
-    #         self.will_message.topic = "new/topic"
-        
-    #     with self.assertRaises(AttributeError):
-    #         self.will_message.payload = b"new payload"
-            
-    #     with self.assertRaises(AttributeError):
-    #         self.will_message.qos = QoSLevel.AT_MOST_ONCE
-            
-    #     with self.assertRaises(AttributeError):
-    #         self.will_message.retain = False
+    def test_will_message_immutability(self):
+        """Test that will message properties cannot be modified after creation"""
+        changes = {
+            "topic": "new/topic",
+            "payload": b"new payload",
+            "qos": QoSLevel.AT_MOST_ONCE,
+            "retain": False,
+            "delay_interval": 0,
+        }
+        for name, value in changes.items():
+            with self.subTest(field=name), self.assertRaises(FrozenInstanceError):
+                setattr(self.will_message, name, value)
 
     def test_will_delay_interval_bounds(self):
         """Test will delay interval validation"""
         # Test negative delay interval
         with self.assertRaises(ValueError):
             WillMessage(
-                topic="test/will",
-                payload=b"test",
+                topic=_WILL_TOPIC,
+                payload=_TEST_PAYLOAD,
                 qos=QoSLevel.AT_MOST_ONCE,
                 retain=False,
                 delay_interval=-1
             )
         
         # Test maximum delay interval (should be within uint32 bounds)
-        max_delay = 4294967295  # 2^32 - 1
         will = WillMessage(
-            topic="test/will",
-            payload=b"test",
+            topic=_WILL_TOPIC,
+            payload=_TEST_PAYLOAD,
             qos=QoSLevel.AT_MOST_ONCE,
             retain=False,
-            delay_interval=max_delay
+            delay_interval=_MAX_DELAY
         )
-        self.assertEqual(will.delay_interval, max_delay)
+        self.assertEqual(will.delay_interval, _MAX_DELAY)
 
     def test_topic_validation(self):
         """Test will message topic validation"""
-        # Test empty topic
-        with self.assertRaises(ValueError):
-            WillMessage(
-                topic="",
-                payload=b"test",
-                qos=QoSLevel.AT_MOST_ONCE,
-                retain=False
-            )
-        
-        # Test topic with wildcards (should not be allowed in will topics)
-        with self.assertRaises(ValueError):
-            WillMessage(
-                topic="test/+/wildcard",
-                payload=b"test",
-                qos=QoSLevel.AT_MOST_ONCE,
-                retain=False
-            )
-        
-        with self.assertRaises(ValueError):
-            WillMessage(
-                topic="test/#",
-                payload=b"test",
-                qos=QoSLevel.AT_MOST_ONCE,
-                retain=False
-            )
+        # Empty topics and topics with wildcards are not allowed in will topics
+        for topic in ["", "test/+/wildcard", "test/#"]:
+            with self.subTest(topic=topic), self.assertRaises(ValueError):
+                WillMessage(
+                    topic=topic,
+                    payload=_TEST_PAYLOAD,
+                    qos=QoSLevel.AT_MOST_ONCE,
+                    retain=False
+                )
             
     def test_invalid_will_message_creation(self):
         """Test invalid will message creation scenarios"""
-        # Test with invalid QoS level (too high)
-        with self.assertRaises(ValueError):
-            WillMessage(
-                topic="test/invalid",
-                payload=b"test",
-                qos=99,  # Invalid QoS value
-                retain=False
-            )
-            
-        # Test with invalid QoS level (negative)
-        with self.assertRaises(ValueError):
-            WillMessage(
-                topic="test/invalid",
-                payload=b"test",
-                qos=-1,  # Invalid QoS value
-                retain=False
-            )
-            
-        # Test with non-bytes payload
-        with self.assertRaises(TypeError):
-            WillMessage(
-                topic="test/invalid",
-                payload="string payload",  # Should be bytes
-                qos=QoSLevel.AT_MOST_ONCE,
-                retain=False
-            )
-            
-        # Test with invalid delay interval type
-        with self.assertRaises(TypeError):
-            WillMessage(
-                topic="test/invalid",
-                payload=b"test",
-                qos=QoSLevel.AT_MOST_ONCE,
-                retain=False,
-                delay_interval="30"  # Should be int
-            )
+        base = dict(
+            topic="test/invalid",
+            payload=_TEST_PAYLOAD,
+            qos=QoSLevel.AT_MOST_ONCE,
+            retain=False
+        )
+        for overrides, exception in _INVALID_WILL_CASES:
+            with self.subTest(**overrides), self.assertRaises(exception):
+                WillMessage(**{**base, **overrides})
 
-class TestWillMessageTriggers(unittest.TestCase):
+@pytest.mark.mqtt
+class TestWillMessageTriggers(unittest.IsolatedAsyncioTestCase):
     """Test suite for will message trigger conditions"""
 
     def setUp(self):
@@ -247,229 +217,148 @@ class TestWillMessageTriggers(unittest.TestCase):
             qos=QoSLevel.AT_LEAST_ONCE,
             retain=True
         )
+
+    @classmethod
+    def setUpClass(cls):
+        """Share one connection handler across the trigger tests"""
+        cls.handler = ConnectionHandler()
+
+        # One recording message handler, emptied between tests
+        published = []
+
+        async def _handle_publish(packet):
+            published.append(packet)
+
+        cls.recorder = SimpleNamespace(_handle_publish=_handle_publish, published=published)
+
+    def tearDown(self):
+        """Drop the per-test client state from the shared handler"""
+        self.handler.connections.clear()
+        self.handler.will_messages.clear()
+        self.handler.session_states.clear()
+        if hasattr(self.handler, 'message_handler'):
+            del self.handler.message_handler
+        self.recorder.published.clear()
+
+    def _connect(self, handler: ConnectionHandler, client_id: str) -> _FakeWriter:
+        """Register a client with a fake writer, the will message and a recording message handler"""
+        writer = _FakeWriter()
+        handler.connections[client_id] = writer
+        handler.will_messages[client_id] = self.will_message
+        handler.message_handler = self.recorder
+        return writer
         
     async def test_network_disconnection_trigger(self):
         """Test will message trigger on network disconnection"""
-        # Setup connection handler with will message
-        handler = ConnectionHandler()
+        # Use the shared connection handler
+        handler = self.handler
         client_id = "test_client"
         
-        # Create a mock StreamWriter
-        mock_writer = Mock()
-        mock_writer.close = Mock()
-        mock_writer.wait_closed = AsyncMock()
-        
         # Register client with will message
-        handler.connections[client_id] = mock_writer
-        handler.will_messages[client_id] = self.will_message
-        
-        # Mock message handler for will message verification
-        handler.message_handler = Mock()
-        handler.message_handler._handle_publish = AsyncMock()
+        writer = self._connect(handler, client_id)
         
         # Trigger unexpected disconnection
         await handler.handle_client_disconnect(client_id, unexpected=True)
         
         # Verify will message was processed
-        self.assertIn(
-            call._handle_publish.call_args[0][0].topic,
-            self.will_message.topic,
-            "Will message topic not matched"
-        )
-        self.assertIn(
-            call._handle_publish.call_args[0][0].payload,
-            self.will_message.payload,
-            "Will message payload not matched"
-        )
+        self.assertEqual(len(handler.message_handler.published), 1)
+        publish_packet = handler.message_handler.published[0]
+        self.assertEqual(publish_packet.topic, self.will_message.topic,
+                         "Will message topic not matched")
+        self.assertEqual(publish_packet.payload, self.will_message.payload,
+                         "Will message payload not matched")
         
         # Verify connection cleanup
-        mock_writer.close.assert_called_once()
-        mock_writer.wait_closed.assert_called_once()
+        self.assertEqual(writer.closed, 1)
+        self.assertEqual(writer.waited, 1)
         self.assertNotIn(client_id, handler.connections)
         self.assertNotIn(client_id, handler.will_messages)
 
     async def test_no_will_message_on_clean_disconnect(self):
         """Test will message should not trigger on clean disconnect"""
-        # Setup connection handler
-        handler = ConnectionHandler()
+        # Use the shared connection handler
+        handler = self.handler
         client_id = "test_client"
         
-        # Create a mock StreamWriter
-        mock_writer = Mock()
-        mock_writer.close = Mock()
-        mock_writer.wait_closed = AsyncMock()
-        
         # Register client with will message
-        handler.connections[client_id] = mock_writer
-        handler.will_messages[client_id] = self.will_message
-        
-        # Mock message handler
-        handler.message_handler = Mock()
-        handler.message_handler._handle_publish = AsyncMock()
+        writer = self._connect(handler, client_id)
         
         # Trigger clean disconnection
         await handler.handle_client_disconnect(client_id, unexpected=False)
         
         # Verify will message was not processed
-        handler.message_handler._handle_publish.assert_not_called()
+        self.assertEqual(handler.message_handler.published, [])
         
         # Verify connection cleanup still occurred
-        mock_writer.close.assert_called_once()
-        mock_writer.wait_closed.assert_called_once()
+        self.assertEqual(writer.closed, 1)
+        self.assertEqual(writer.waited, 1)
         self.assertNotIn(client_id, handler.connections)
 
     async def test_will_message_on_keep_alive_timeout(self):
         """Test will message trigger on keep alive timeout"""
-        # Setup connection handler
-        handler = ConnectionHandler()
+        # Use the shared connection handler
+        handler = self.handler
         client_id = "test_client"
-        keep_alive = 2  # Short timeout for testing
-        
-        # Create a mock StreamWriter
-        mock_writer = Mock()
-        mock_writer.close = Mock()
-        mock_writer.wait_closed = AsyncMock()
+        keep_alive = 0.02  # Fractional keep-alive keeps the wait to ~30 ms
         
         # Register client with will message
-        handler.connections[client_id] = mock_writer
-        handler.will_messages[client_id] = self.will_message
-        
-        # Mock message handler
-        handler.message_handler = Mock()
-        handler.message_handler._handle_publish = AsyncMock()
+        writer = self._connect(handler, client_id)
         
         # Start keep-alive monitoring
         monitor_task = asyncio.create_task(
             handler._monitor_keep_alive(client_id, keep_alive)
         )
         
-        # Wait for timeout and monitoring to complete
-        await asyncio.sleep(keep_alive * 1.5 + 0.1)  # Wait slightly longer than timeout
-        await monitor_task
+        # The monitor returns as soon as the 1.5x keep-alive timeout fires
+        await asyncio.wait_for(monitor_task, timeout=1)
         
         # Verify will message was processed
-        handler.message_handler._handle_publish.assert_called_once()
-        publish_packet = handler.message_handler._handle_publish.call_args[0][0]
+        self.assertEqual(len(handler.message_handler.published), 1)
+        publish_packet = handler.message_handler.published[0]
         self.assertEqual(publish_packet.topic, self.will_message.topic)
         self.assertEqual(publish_packet.payload, self.will_message.payload)
         
         # Verify connection cleanup
-        mock_writer.close.assert_called_once()
-        mock_writer.wait_closed.assert_called_once()
+        self.assertEqual(writer.closed, 1)
+        self.assertEqual(writer.waited, 1)
         self.assertNotIn(client_id, handler.connections)
 
-    async def test_will_message_session_cleanup(self):
-        """Test will message and session cleanup after disconnection"""
-        # Setup connection handler
-        handler = ConnectionHandler()
+    async def _disconnect_with_session(self, clean_session: bool) -> str:
+        """Drop a client holding a session unexpectedly and check the will was published"""
+        # Use the shared connection handler
+        handler = self.handler
         client_id = "test_client"
         
         # Create session state
         handler.session_states[client_id] = SessionState(
             client_id=client_id,
-            clean_session=True,
+            clean_session=clean_session,
             subscriptions={},
             pending_messages={},
-            timestamp=datetime.now()
+            timestamp=_FIXED_TS
         )
         
-        # Create a mock StreamWriter
-        mock_writer = Mock()
-        mock_writer.close = Mock()
-        mock_writer.wait_closed = AsyncMock()
-        
         # Register client with will message
-        handler.connections[client_id] = mock_writer
-        handler.will_messages[client_id] = self.will_message
-        
-        # Mock message handler
-        handler.message_handler = Mock()
-        handler.message_handler._handle_publish = AsyncMock()
+        self._connect(handler, client_id)
         
         # Trigger unexpected disconnection
         await handler.handle_client_disconnect(client_id, unexpected=True)
         
-        # Verify complete cleanup
+        # Verify will message processed and connection cleaned up
+        self.assertEqual(len(handler.message_handler.published), 1)
         self.assertNotIn(client_id, handler.connections)
         self.assertNotIn(client_id, handler.will_messages)
-        self.assertNotIn(client_id, handler.session_states)
+        return client_id
+
+    async def test_will_message_session_cleanup(self):
+        """Test will message and session cleanup after disconnection"""
+        client_id = await self._disconnect_with_session(clean_session=True)
+        self.assertNotIn(client_id, self.handler.session_states)
 
     async def test_will_message_with_retained_session(self):
         """Test will message handling with retained session state"""
-        # Setup connection handler
-        handler = ConnectionHandler()
-        client_id = "test_client"
-        
-        # Create session state with clean_session=False
-        handler.session_states[client_id] = SessionState(
-            client_id=client_id,
-            clean_session=False,  # Retained session
-            subscriptions={},
-            pending_messages={},
-            timestamp=datetime.now()
-        )
-        
-        # Create a mock StreamWriter
-        mock_writer = Mock()
-        mock_writer.close = Mock()
-        mock_writer.wait_closed = AsyncMock()
-        
-        # Register client with will message
-        handler.connections[client_id] = mock_writer
-        handler.will_messages[client_id] = self.will_message
-        
-        # Mock message handler
-        handler.message_handler = Mock()
-        handler.message_handler._handle_publish = AsyncMock()
-        
-        # Trigger unexpected disconnection
-        await handler.handle_client_disconnect(client_id, unexpected=True)
-        
-        # Verify will message processed but session retained
-        handler.message_handler._handle_publish.assert_called_once()
-        self.assertNotIn(client_id, handler.connections)
-        self.assertNotIn(client_id, handler.will_messages)
-        self.assertIn(client_id, handler.session_states)  # Session should be retained
+        client_id = await self._disconnect_with_session(clean_session=False)
+        self.assertIn(client_id, self.handler.session_states)  # Session should be retained
 
 if __name__ == '__main__':
-    """Run will message test suites"""
-    
-    # Create event loop for async tests
-    loop = asyncio.get_event_loop()
-    
-    suite = unittest.TestSuite()
-    
-    # Add test classes to suite
-    suite.addTest(TestWillMessageSetup("test_will_message_creation"))
-    suite.addTest(TestWillMessageSetup("test_will_message_default_values"))
-    suite.addTest(TestWillMessageSetup("test_will_message_payload_types"))
-    suite.addTest(TestWillMessageSetup("test_qos_level_validation"))
-    suite.addTest(TestWillMessageSetup("test_will_message_verify_content"))
-
-    suite.addTest(TestWillMessageBehavior("test_will_delay_interval_bounds"))
-    suite.addTest(TestWillMessageBehavior("test_topic_validation"))
-    suite.addTest(TestWillMessageBehavior("test_invalid_will_message_creation"))
-
-    # Add improved trigger tests
-    suite.addTest(TestWillMessageTriggers("test_network_disconnection_trigger"))
-    suite.addTest(TestWillMessageTriggers("test_no_will_message_on_clean_disconnect"))
-    suite.addTest(TestWillMessageTriggers("test_will_message_on_keep_alive_timeout"))
-    suite.addTest(TestWillMessageTriggers("test_will_message_session_cleanup"))
-    suite.addTest(TestWillMessageTriggers("test_will_message_with_retained_session"))
-
-    # Run tests
-    runner = unittest.TextTestRunner(verbosity=2)
-    result = runner.run(suite)
-    
-    # Run async tests
-    async_tests = []
-    for test in suite._tests:
-        if test and hasattr(test, '_testMethodName'):
-            method = getattr(test, test._testMethodName)
-            if asyncio.iscoroutinefunction(method):
-                async_tests.append(test._callTestMethod())
-    
-    if async_tests:
-        loop.run_until_complete(asyncio.gather(*async_tests))
-    
-    loop.close()
\ No newline at end of file
+    unittest.main(verbosity=2)